@@ -0,0 +1,58 @@
+# Classify newline-delimited records with a model written by Model.save():
+#    python -m algorithms.classifiers.cli model.bin [input file, default stdin]
+#
+# Every record is split in features on whitespace, one line is written for
+# each record: the most likely class and its probability, tab separated.
+# The throughput is reported on stderr.
+import argparse
+import sys
+import time
+
+from algorithms.classifiers.naive_bayes import Classifier, Model
+
+
+def tokenize(record):
+    return tuple(record.split())
+
+
+class Throughput:
+    def __init__(self, out, every):
+        self.out = out
+        self.every = every
+        self.start = time.time()
+        self.reported = 0
+    
+    def __call__(self, items):
+        if items - self.reported >= self.every:
+            self.report(items)
+    
+    def report(self, items):
+        elapsed = max(time.time() - self.start, 1e-9)
+        self.out.write("%d items in %.1fs (%.0f items/s)\n" % (items, elapsed, items / elapsed))
+        self.reported = items
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify records with a naive Bayes model")
+    parser.add_argument('model', help="model file written by Model.save()")
+    parser.add_argument('input', nargs='?', help="records file, default stdin")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--report-every', type=int, default=100000,
+                        help="items between the throughput reports")
+    args = parser.parse_args(argv)
+    
+    classifier = Classifier(Model.load(args.model))
+    source = open(args.input, 'rb') if args.input else sys.stdin
+    throughput = Throughput(sys.stderr, args.report_every)
+    count = 0
+    try:
+        for label, probs in classifier.classify_stream(source, args.batch_size, tokenize, throughput):
+            sys.stdout.write("%s\t%.6f\n" % (label, probs[label]))
+            count += 1
+    finally:
+        if source is not sys.stdin: source.close()
+    if throughput.reported != count: throughput.report(count)
+
+
+if __name__ == '__main__':
+    main()
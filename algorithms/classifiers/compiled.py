@@ -0,0 +1,157 @@
+from numpy import argmax, array, errstate, exp, log, zeros
+from scipy.sparse import csr_matrix
+
+from hashing import bucket
+
+
+class CompiledModel:
+    """
+    Naive Bayes model compiled for vectorized classification in log space:
+        
+        vocabulary[f]  = j: column of feature f
+        log_prior[c]   = log P(C)
+        log_prob[c, j] = log P(f_j|C)
+        log_base[c]    = log (Base Probability of C), for features that are
+                         not in the vocabulary
+    
+    For a hashed model the vocabulary is None and the columns are the buckets:
+    every feature has a column, there are no unknown features. In a loaded
+    model the vocabulary is the storage.NameIds of the memory-mapped table.
+    
+    The score of an item is the sum of the logs instead of the product of the
+    probabilities, so that it does not underflow to 0 on long items:
+        
+        log P(C|f1, f2, ...) ~ log P(C) + log P(f1|C) + log P(f2|C) + ...
+    """
+    def __init__(self, names, vocabulary, log_prior, log_prob, log_base):
+        self.names = names
+        self.vocabulary = vocabulary
+        self.log_prior = log_prior
+        self.log_prob = log_prob
+        self.log_base = log_base
+    
+    @classmethod
+    def from_model(cls, model):
+        classes = model.classes.values()
+        if model.buckets is not None:
+            with errstate(divide='ignore'):
+                return cls([c.name for c in classes], None,
+                           log(array([c.prior for c in classes])),
+                           log(array([c.feature_prob for c in classes]).reshape(len(classes), model.buckets)),
+                           log(array([c.base_prob for c in classes])))
+        
+        vocabulary = {}
+        for c in classes:
+            for feature in c.feature_prob:
+                vocabulary.setdefault(feature, len(vocabulary))
+        
+        features = cls.features(vocabulary)
+        with errstate(divide='ignore'):
+            return cls([c.name for c in classes], vocabulary,
+                       log(array([c.prior for c in classes])),
+                       log(array([[c.P(f) for f in features] for c in classes]).reshape(len(classes), len(features))),
+                       log(array([c.base_prob for c in classes])))
+    
+    @staticmethod
+    def features(vocabulary):
+        """
+        Features in the order of their columns.
+        """
+        if vocabulary is None: return None
+        return sorted(vocabulary, key=vocabulary.get)
+    
+    def column(self, feature):
+        if self.vocabulary is None:
+            return bucket(feature, self.log_prob.shape[1])
+        return self.vocabulary.get(feature)
+    
+    def features_matrix(self, items):
+        """
+        Sparse (items x vocabulary) matrix of feature counts, and the number of
+        features of every item that are not in the vocabulary.
+        """
+        rows, cols = [], []
+        unknown = zeros(len(items))
+        if self.vocabulary is None:
+            buckets = self.log_prob.shape[1]
+            for i, item in enumerate(items):
+                for feature in item:
+                    rows.append(i)
+                    cols.append(bucket(feature, buckets))
+            counts = csr_matrix(([1.0] * len(rows), (rows, cols)), shape=(len(items), buckets))
+            return counts, unknown
+        
+        for i, item in enumerate(items):
+            for feature in item:
+                j = self.vocabulary.get(feature)
+                if j is None:
+                    unknown[i] += 1
+                else:
+                    rows.append(i)
+                    cols.append(j)
+        
+        counts = csr_matrix(([1.0] * len(rows), (rows, cols)), shape=(len(items), len(self.vocabulary)))
+        return counts, unknown
+    
+    def log_probabilities(self, items):
+        """
+        (items x classes) matrix of the log scores, in the order of names.
+        """
+        counts, unknown = self.features_matrix(items)
+        scores = counts.dot(self.log_prob.T) + self.log_prior
+        has_unknown = unknown > 0 # avoid 0 * -inf when the base probability is 0
+        scores[has_unknown] += unknown[has_unknown, None] * self.log_base
+        return scores
+    
+    def classify_batch(self, items):
+        scores = self.log_probabilities(items)
+        return [self.names[c] for c in argmax(scores, axis=1)]
+    
+    def normalised_probabilities(self, items):
+        """
+        P(C|item) for every item, normalised with the "total probability".
+        If all the classes have probability 0 they stay 0.
+        """
+        probs = normalise(self.log_probabilities(items))
+        return [dict(zip(self.names, p)) for p in probs.tolist()]
+    
+    def classify_with_probabilities(self, items):
+        """
+        (most likely class, normalised probabilities) of each item, scoring
+        the items only once.
+        """
+        scores = self.log_probabilities(items)
+        labels = [self.names[c] for c in argmax(scores, axis=1)]
+        return zip(labels, [dict(zip(self.names, p)) for p in normalise(scores).tolist()])
+
+
+def normalise(scores):
+    top = scores.max(axis=1)[:, None]
+    top[top == -float('inf')] = 0
+    probs = exp(scores - top)
+    totals = probs.sum(axis=1)[:, None]
+    totals[totals == 0] = 1
+    probs /= totals
+    return probs
+
+
+class CompiledClass:
+    """
+    Read-only class of a CompiledModel, with the interface of naive_bayes.Class
+    (for models that have been loaded from a file).
+    """
+    def __init__(self, model, index):
+        self.model = model
+        self.index = index
+        self.name = model.names[index]
+        self.prior = float(exp(model.log_prior[index]))
+        self.base_prob = float(exp(model.log_base[index]))
+    
+    def P(self, f):
+        j = self.model.column(f)
+        if j is None:
+            return self.base_prob
+        return float(exp(self.model.log_prob[self.index, j]))
+    
+    def __str__(self):
+        return '[%s] P(C)=%.4f base P(f|C)=%.4f' % (self.name, self.prior, self.base_prob)
@@ -0,0 +1,52 @@
+from zlib import crc32
+from numpy import add, zeros
+
+from naive_bayes import Class, ClassCounter
+
+
+# Feature hashing: every feature is mapped to one of a fixed number of buckets,
+# features that collide in the same bucket are counted as the same feature.
+# The hash is CRC-32 of the feature (utf-8 for unicode, repr() if it is not a
+# string): unlike hash() it is the same in every process and platform, so the
+# buckets of a saved model can be shared.
+HASH_FUNCTION = 'crc32'
+
+def bucket(feature, buckets):
+    if isinstance(feature, unicode):
+        feature = feature.encode('utf-8')
+    elif not isinstance(feature, str):
+        feature = repr(feature)
+    return (crc32(feature) & 0xffffffff) % buckets
+
+
+class HashedClass(Class):
+    """
+    Class whose P(f|C) is a dense array indexed by bucket.
+    """
+    def __init__(self, name, base_prob, buckets):
+        Class.__init__(self, name, base_prob)
+        self.feature_prob = zeros(buckets) + base_prob
+    
+    def P(self, f):
+        return self.feature_prob[bucket(f, len(self.feature_prob))]
+
+
+class HashedClassCounter(ClassCounter):
+    """
+    ClassCounter whose features_count is a dense array of counts by bucket.
+    """
+    def __init__(self, name, buckets):
+        ClassCounter.__init__(self, name)
+        self.features_count = zeros(buckets, dtype='int64')
+    
+    def add_item(self, item):
+        buckets = len(self.features_count)
+        self.num_items += 1
+        if len(item) == 0: return
+        add.at(self.features_count, [bucket(f, buckets) for f in item], 1)
+        self.num_features += len(item)
+    
+    def merge(self, other):
+        self.num_items += other.num_items
+        self.features_count += other.features_count
+        self.num_features += other.num_features
@@ -1,4 +1,6 @@
 from collections import Counter
+from itertools import islice
+from multiprocessing import Pool, cpu_count
 
 
 class Class:
@@ -28,10 +30,72 @@ class ClassCounter:
         self.features_count = Counter() # P(f|C): tot appearances of feature f in items of class C
         self.num_features = 0           # P(f|C): tot features appearances in items of class C
     
+    def add_item(self, item):
+        self.num_items += 1
+        for feature in item:
+            self.features_count[feature] += 1
+            self.num_features += 1
+    
+    def merge(self, other):
+        """
+        Add the counts of another counter of the same class.
+        """
+        self.num_items += other.num_items
+        self.features_count.update(other.features_count)
+        self.num_features += other.num_features
+    
     def __str__(self):
         return '[%s] (%d) features in (%d) items: %s' % (self.name, self.num_features, self.num_items, self.features_count)
 
 
+def class_counter(name, buckets=None):
+    if buckets is None:
+        return ClassCounter(name)
+    
+    from hashing import HashedClassCounter
+    return HashedClassCounter(name, buckets)
+
+
+def count_classes(data, buckets=None):
+    """
+    Count the features of the training data, one ClassCounter per class name.
+    Counters of different parts of the data can be merged in any order.
+    """
+    counters = {}
+    for class_name, class_data in data:
+        counter = counters.get(class_name)
+        if counter is None:
+            counter = counters[class_name] = class_counter(class_name, buckets)
+        for item in class_data:
+            counter.add_item(item)
+    return counters
+
+
+# Training data shared with the worker processes of Model.train_parallel: it
+# is inherited through fork, the workers only receive the bounds of a shard
+worker_data = None
+
+def init_worker(data):
+    global worker_data
+    worker_data = data
+
+
+def count_shard(shard):
+    class_index, start, end, buckets = shard
+    class_name, class_data = worker_data[class_index]
+    return count_classes([(class_name, class_data[start:end])], buckets)
+
+
+def shards(data, shard_size, buckets=None):
+    """
+    Split the training data in (class index, start, end, buckets) parts of at
+    most shard_size items.
+    """
+    for class_index, (class_name, class_data) in enumerate(data):
+        for start in range(0, len(class_data), shard_size):
+            yield class_index, start, min(start + shard_size, len(class_data)), buckets
+
+
 class Model:
     """
     P(C|f) = P(f|C) * P(C) / P(f)
@@ -67,33 +131,206 @@ class Model:
         )),
         ...
     )
+    
+    The raw counts are kept in the model (one ClassCounter per class), so that
+    it can be trained incrementally with partial_fit(): the probabilities are
+    recomputed lazily, only for the classes whose counts changed (for all the
+    classes when new types of features appear).
+    
+    With buckets, features are hashed in that many buckets (requires numpy):
+    memory does not depend on the vocabulary, counts and P(f|C) are dense
+    arrays indexed by bucket. Features that collide in a bucket are counted as
+    the same feature, and the different types of features are the buckets
+    that have been used.
     """
-    def __init__(self, data, k=1):
+    def __init__(self, data=(), k=1, buckets=None):
+        self.k = float(k)
+        self.buckets = buckets
+        
         # keep count of all the different types of features among all the classes
-        features_count = set([])
-        class_counters = []
-        tot_items = 0
-        for class_name, class_data in data:
-            class_counter = ClassCounter(class_name)
-            class_counters.append(class_counter)
-            for item in class_data:
-                tot_items += 1
-                class_counter.num_items += 1
-                for feature in item:
-                    features_count.add(feature)
-                    class_counter.features_count[feature] += 1
-                    class_counter.num_features += 1
-        
-        self.classes = {}
-        self.features_num = len(features_count)
-        k = float(k)
-        for class_counter in class_counters:
+        if buckets is None:
+            self.features_count = set([])
+        else:
+            from numpy import zeros
+            self.features_count = zeros(buckets, dtype=bool)
+        self.features_num = 0
+        self.counters = {}
+        self.tot_items = 0
+        
+        self._classes = {}
+        self._stale = set([]) # classes whose P(f|C) has to be recomputed
+        self._stale_priors = False
+        self._compiled = None
+        self.partial_fit(data)
+    
+    def partial_fit(self, data):
+        """
+        Add more training data, in the same format of the constructor.
+        """
+        self.merge(count_classes(data, self.buckets))
+    
+    def merge(self, counters):
+        """
+        Add the counts of the classes (as returned by count_classes).
+        """
+        if self.counters is None:
+            raise Exception("Unable to train a loaded model, it has no counts")
+        
+        for class_name, counter in counters.items():
+            if class_name not in self.counters:
+                self.counters[class_name] = class_counter(class_name, self.buckets)
+            self.counters[class_name].merge(counter)
+            self.tot_items += counter.num_items
+            if self.buckets is None:
+                self.features_count.update(counter.features_count)
+            else:
+                self.features_count |= counter.features_count > 0
+            self._stale.add(class_name)
+        
+        features_num = len(self.features_count) if self.buckets is None else int(self.features_count.sum())
+        if features_num != self.features_num:
+            # the smoothing of every class depends on the number of features
+            self.features_num = features_num
+            self._stale.update(self.counters.keys())
+        self._stale_priors = True
+        self._compiled = None
+    
+    @classmethod
+    def train_parallel(cls, data, k=1, workers=None, shard_size=10000, buckets=None):
+        """
+        Map-reduce training: the data is split in shards of shard_size items,
+        counted in a pool of workers processes (one per CPU by default), and
+        the counters are merged as they come. The model is the same as the one
+        trained serially.
+        """
+        data = [(class_name, list(class_data)) for class_name, class_data in data]
+        model = cls(k=k, buckets=buckets)
+        pool = Pool(workers or cpu_count(), init_worker, (data,))
+        try:
+            for counters in pool.imap_unordered(count_shard, shards(data, shard_size, buckets)):
+                model.merge(counters)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        return model
+    
+    @property
+    def classes(self):
+        k = self.k
+        for class_name in self._stale:
+            class_counter = self.counters[class_name]
             norm = float(class_counter.num_features + k * self.features_num)
-            model_class = Class(class_counter.name, k / norm)
-            model_class.prior = float(class_counter.num_items + k) / float(tot_items + k*len(class_counters))
+            model_class = self._classes.get(class_name)
+            if model_class is None:
+                model_class = self._classes[class_name] = self._new_class(class_name)
+            model_class.base_prob = k / norm
+            if self.buckets is not None:
+                model_class.feature_prob = (class_counter.features_count + k) / norm
+                continue
+            
+            model_class.feature_prob = {}
             for feature, count in class_counter.features_count.iteritems():
                 model_class.feature_prob[feature] = float(count + k) / norm
-            self.classes[class_counter.name] = model_class
+        self._stale.clear()
+        
+        # priors depend on the total number of items, they change with any data
+        if self._stale_priors:
+            for class_name, model_class in self._classes.iteritems():
+                model_class.prior = float(self.counters[class_name].num_items + k) / float(self.tot_items + k*len(self.counters))
+            self._stale_priors = False
+        return self._classes
+    
+    def _new_class(self, class_name):
+        if self.buckets is None:
+            return Class(class_name, 0.0)
+        
+        from hashing import HashedClass
+        return HashedClass(class_name, 0.0, self.buckets)
+    
+    def compile(self):
+        """
+        Vectorized log-space representation of the model (requires numpy and
+        scipy), see compiled.CompiledModel.
+        """
+        if self._compiled is None:
+            from compiled import CompiledModel
+            self._compiled = CompiledModel.from_model(self)
+        return self._compiled
+    
+    SNAPSHOT_MAGIC = 'NBAYESMD'
+    SNAPSHOT_VERSION = 3
+    
+    def save(self, path, dtype='float64'):
+        """
+        Write the compiled model to a binary file: the vocabulary (as a
+        storage.NameTable), the log priors and the log probabilities in dtype
+        (float32 halves the size).
+        The counts are not saved, a loaded model cannot be trained further.
+        A hashed model also records its hash function (see hashing.bucket).
+        """
+        from algorithms.storage import NameIds, NameTable, write_arrays
+        
+        compiled = self.compile()
+        meta = {
+            'names': compiled.names,
+            'vocabulary': None,
+            'k': self.k,
+            'buckets': self.buckets,
+            'hash_function': None,
+            'features_num': self.features_num,
+        }
+        arrays = {
+            'log_prior': compiled.log_prior.astype(dtype),
+            'log_prob': compiled.log_prob.astype(dtype),
+            'log_base': compiled.log_base.astype(dtype),
+        }
+        if self.buckets is not None:
+            from hashing import HASH_FUNCTION
+            meta['hash_function'] = HASH_FUNCTION
+        else:
+            vocabulary = compiled.vocabulary
+            if isinstance(vocabulary, NameIds):
+                vocabulary = vocabulary.table
+            else:
+                vocabulary = NameTable.from_names(compiled.features(vocabulary))
+            arrays.update(vocabulary.arrays('vocabulary'))
+            meta['vocabulary'] = vocabulary.kind
+        write_arrays(path, self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, meta, arrays)
+    
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a model written by save(), with mmap the log probabilities and
+        the vocabulary are memory-mapped so that processes share the same
+        pages: features are looked up in the vocabulary without building a
+        dict.
+        """
+        from algorithms.storage import NameTable, read_arrays
+        from compiled import CompiledModel, CompiledClass
+        
+        version, meta, arrays = read_arrays(path, cls.SNAPSHOT_MAGIC, mmap)
+        if version != cls.SNAPSHOT_VERSION:
+            raise Exception("Unsupported model version: %d" % version)
+        if meta['buckets'] is not None:
+            from hashing import HASH_FUNCTION
+            if meta['hash_function'] != HASH_FUNCTION:
+                raise Exception("Unable to load a hashed model with hash function %s" % meta['hash_function'])
+        vocabulary = None
+        if meta['vocabulary'] is not None:
+            vocabulary = NameTable.from_arrays(meta['vocabulary'], arrays, 'vocabulary').ids
+        
+        model = cls(k=meta['k'])
+        model.buckets = meta['buckets']
+        model.features_count = None
+        model.features_num = meta['features_num']
+        model.counters = None
+        model._stale_priors = False
+        model._compiled = CompiledModel(meta['names'], vocabulary, arrays['log_prior'],
+                                        arrays['log_prob'], arrays['log_base'])
+        for index, name in enumerate(meta['names']):
+            model._classes[name] = CompiledClass(model._compiled, index)
+        return model
     
     def __str__(self):
         return '\n'.join(map(str, self.classes.values()))
@@ -112,8 +349,20 @@ class Classifier:
     def __init__(self, model=None):
         self.model = model
     
-    def train(self, data):
-        self.model = Model(data)
+    def train(self, data, workers=1):
+        if workers == 1:
+            self.model = Model(data)
+        else:
+            self.model = Model.train_parallel(data, workers=workers)
+    
+    def partial_fit(self, data):
+        """
+        Train the current model with more data, without starting from scratch.
+        """
+        if self.model is None:
+            self.model = Model(data)
+        else:
+            self.model.partial_fit(data)
     
     def get_probabilities(self, item):
         if self.model is None:
@@ -132,7 +381,47 @@ class Classifier:
         
         # return most likely class
         probs.sort(reverse=True)
-        return probs[0].name
+        return probs[0].model_class.name
+    
+    def _compiled_model(self):
+        if self.model is None:
+            raise Exception("Unable to classify without a model")
+        return self.model.compile()
+    
+    def classify_batch(self, items):
+        """
+        Most likely class of each item, scoring all the items at once in log
+        space: unlike classify() it does not underflow on long items.
+        """
+        return self._compiled_model().classify_batch(items)
+    
+    def get_normalised_probabilities_batch(self, items):
+        return self._compiled_model().normalised_probabilities(items)
+    
+    def classify_stream(self, items, batch_size=1000, tokenizer=None, progress=None):
+        """
+        Lazily classify an iterable of items (of records, split in features by
+        tokenizer if given) in batches of batch_size, yielding
+        (most likely class, normalised probabilities) in the same order:
+        memory depends on batch_size, not on the length of the stream.
+        
+        progress(items), if given, is called with the number of items
+        classified so far after every batch.
+        """
+        model = self._compiled_model()
+        if tokenizer is not None:
+            items = (tokenizer(record) for record in items)
+        
+        items = iter(items)
+        count = 0
+        while True:
+            batch = list(islice(items, batch_size))
+            if len(batch) == 0: break
+            
+            for result in model.classify_with_probabilities(batch):
+                yield result
+            count += len(batch)
+            if progress is not None: progress(count)
     
     def get_normalised_probabilities(self, item):
         probs = self.get_probabilities(item)
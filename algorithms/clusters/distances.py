@@ -0,0 +1,70 @@
+import os
+import tempfile
+from numpy import asarray, dtype as numpy_dtype, einsum, maximum, memmap, sqrt, zeros
+
+
+def as_values(items, dtype='float64'):
+    """
+    (n, d) array of the values of the items, items can also be the array.
+    """
+    if isinstance(items, (list, tuple)) and len(items) > 0 and hasattr(items[0], 'values'):
+        items = [item.values for item in items]
+    values = asarray(items, dtype=dtype)
+    if values.ndim != 2:
+        values = values.reshape(len(values), -1 if len(values) > 0 else 0)
+    return values
+
+
+def condensed_array(size, dtype='float64', path=None, memory_limit=None):
+    """
+    Array of size values, in memory or memory-mapped on the file at path: if
+    path is not given, but the array is larger than memory_limit bytes, the
+    file is temporary (it is removed when the array is released).
+    """
+    if path is None and memory_limit is not None and size * numpy_dtype(dtype).itemsize > memory_limit:
+        fd, temporary = tempfile.mkstemp(suffix='.distances')
+        os.close(fd)
+        try:
+            return memmap(temporary, dtype, 'w+', shape=(max(size, 1),))[:size]
+        finally:
+            os.remove(temporary) # the mapping keeps the data
+    
+    if path is not None:
+        return memmap(path, dtype, 'w+', shape=(max(size, 1),))[:size]
+    return zeros(size, dtype)
+
+
+def pairwise_distances(values, squared=False, dtype='float64', block_size=2 ** 22,
+                       path=None, memory_limit=None):
+    """
+    Condensed matrix of the euclidean distances of the rows of an (n, d) array:
+    d(i, j) for i < j, in the order (0, 1), (0, 2), ..., (1, 2), ...
+    
+    The rows are compared a block at a time, with a matrix product:
+        ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b
+    each block with at most block_size distances. With dtype='float32' memory
+    is halved, but the distances of close points lose precision.
+    See condensed_array for path and memory_limit.
+    """
+    values = as_values(values, dtype)
+    n = len(values)
+    distances = condensed_array(n * (n - 1) // 2, dtype, path, memory_limit)
+    norms = einsum('ij,ij->i', values, values)
+    
+    rows = max(block_size // max(n, 1), 1)
+    start = 0
+    for i in range(0, n - 1, rows):
+        block = values[i:i + rows].dot(values[i:].T)
+        block *= -2
+        block += norms[i:i + rows, None]
+        block += norms[None, i:]
+        maximum(block, 0, out=block) # rounding errors
+        if not squared:
+            sqrt(block, out=block)
+        
+        for r in range(len(block)):
+            # distances of the row i+r from the rows after it
+            row = block[r, r + 1:]
+            distances[start:start + len(row)] = row
+            start += len(row)
+    return distances
@@ -1,6 +1,9 @@
 from numpy import array, mean
 from numpy.linalg import norm
 
+from distances import as_values
+from linkage import cluster_labels, linkage, merges_for_count, merges_within
+
 
 class Item:
     def __init__(self, name, values):
@@ -18,9 +21,15 @@ class Item:
 
 
 class Group(Item):
-    def __init__(self, items):
+    def __init__(self, items, values=None):
+        """
+        values: centroid of the group, when it is not the mean of the items
+        (e.g. the items are only a part of the group).
+        """
         self.items = items
-        self.values = mean(array([i.values for i in self.items]), axis=0)
+        if values is None:
+            values = mean(array([i.values for i in self.items]), axis=0)
+        self.values = array(values)
         self.name = None
     
     def __str__(self):
@@ -29,37 +38,54 @@ class Group(Item):
         return "%s[%s]" % (name, ', '.join([i.name for i in self.items]))
 
 
-def pop_items(l, indexes):
-    indexes.sort(reverse=True)
-    return [l.pop(index) for index in indexes]
+def as_items(items):
+    """
+    Items, named by index if items is an (n, d) array.
+    """
+    if isinstance(items, (list, tuple)):
+        return items
+    return [Item(i, values) for i, values in enumerate(as_values(items))]
 
 
-def find_clusters(items, clusters_names):
-    # Initially create a group for each item
-    groups = [Group([item]) for item in items]
+def cut(items, tree, num_merges):
+    items = as_items(items)
+    if len(items) == 0:
+        return []
     
-    # Iterate until the number of groups match the desired number of clusters
-    num_clusters = len(clusters_names)
-    while len(groups) > num_clusters:
-        
-        # Find the closest pair of groups
-        closest_pair, shortest_distance = None, None
-        for a in range(len(groups)):
-            for b in range(a+1, len(groups)):
-                
-                # Calculate distance
-                distance = groups[a].distance(groups[b])
-                
-                # Keep shortest distance
-                if shortest_distance is None or distance < shortest_distance:
-                    shortest_distance = distance
-                    closest_pair = [a, b]
-        
-        # Merge the closest pair of groups
-        a, b = pop_items(groups, closest_pair)
-        groups.append(Group(a.items + b.items))
+    groups = {}
+    for item, label in zip(items, cluster_labels(tree, num_merges)):
+        groups.setdefault(label, []).append(item)
     
+    groups = [Group(group) for group in groups.values()]
     groups.sort(reverse=True)
+    return groups
+
+
+def cut_by_count(items, tree, num_clusters):
+    """
+    Groups of the items when the merge tree (as returned by linkage.linkage
+    for their values) is cut at num_clusters clusters.
+    """
+    return cut(items, tree, merges_for_count(tree, num_clusters))
+
+
+def cut_by_distance(items, tree, max_distance):
+    """
+    Groups of the items when the merge tree is cut before the first merge
+    farther than max_distance.
+    """
+    return cut(items, tree, merges_within(tree, max_distance))
+
+
+def find_clusters(items, clusters_names, method='centroid', dtype='float64', memory_limit=None):
+    """
+    Group the items (or the rows of an (n, d) array) in as many clusters as
+    clusters_names, merging every time the closest pair of groups: with
+    centroid linkage the distance of two groups is the distance of their
+    means (see linkage.linkage for the other methods and the options).
+    """
+    tree = linkage(items, method, dtype, memory_limit)
+    groups = cut_by_count(items, tree, len(clusters_names))
     for group, cluster_name in zip(groups, clusters_names):
         group.name = cluster_name
     
@@ -0,0 +1,166 @@
+from numpy import argmin, asarray, bincount, einsum, minimum, vstack, zeros
+from numpy.random import RandomState
+
+from distances import as_values
+from hierarchical import Group, find_clusters
+
+
+def batches(stream, batch_size):
+    """
+    (m, d) arrays of at most batch_size values, from a stream of Items and of
+    arrays of values.
+    """
+    items = []
+    for element in stream:
+        if hasattr(element, 'values'):
+            items.append(element)
+            if len(items) == batch_size:
+                yield as_values(items)
+                items = []
+            continue
+        
+        values = as_values(element)
+        for start in range(0, len(values), batch_size):
+            yield values[start:start + batch_size]
+    
+    if len(items) > 0:
+        yield as_values(items)
+
+
+def squared_distances(values, centers):
+    """
+    (m, k) squared distances of m values from k centers.
+    """
+    distances = values.dot(centers.T)
+    distances *= -2
+    distances += einsum('ij,ij->i', values, values)[:, None]
+    distances += einsum('ij,ij->i', centers, centers)[None, :]
+    return distances
+
+
+def kmeans_plus_plus(values, k, random):
+    """
+    k centers among values: every center is chosen with probability
+    proportional to the squared distance from the closest center so far.
+    """
+    centers = [values[random.randint(len(values))]]
+    closest = squared_distances(values, asarray(centers))[:, 0]
+    for _ in range(1, k):
+        total = closest.sum()
+        if total > 0:
+            index = min(closest.cumsum().searchsorted(random.random_sample() * total), len(values) - 1)
+        else:
+            index = random.randint(len(values))
+        centers.append(values[index])
+        closest = minimum(closest, squared_distances(values, asarray(centers[-1:]))[:, 0])
+    return asarray(centers)
+
+
+def hierarchical_seeds(values, k):
+    """
+    k centers: the means of the clusters of the values found by find_clusters.
+    """
+    return asarray([group.values for group in find_clusters(values, range(k))])
+
+
+class MiniBatchKMeans:
+    """
+    k-means on a stream of values, updated one batch at a time: every center
+    moves towards the mean of the values assigned to it, with a learning rate
+    of 1 / (values assigned to it so far), so that it is the mean of all of
+    them. Memory depends on k, batch_size and init_size, not on the stream.
+    
+    The initial centers are chosen among the first init_size values, with
+    k-means++ (init='k-means++') or with the hierarchical clustering of them
+    (init='hierarchical').
+    """
+    def __init__(self, k, batch_size=1000, init='k-means++', init_size=None, seed=None):
+        if init not in ('k-means++', 'hierarchical'):
+            raise Exception("Unknown initialization: %s" % init)
+        self.k = k
+        self.batch_size = batch_size
+        self.init = init
+        self.init_size = init_size or max(3 * k, batch_size)
+        self.random = RandomState(seed)
+        
+        self.centers = None
+        self.counts = zeros(k)
+    
+    def fit(self, stream):
+        """
+        Train on a stream of Items or of arrays of values, return self.
+        """
+        sample = []
+        for batch in batches(stream, self.batch_size):
+            if self.centers is not None:
+                self.partial_fit(batch)
+                continue
+            
+            # the first values are kept to choose the initial centers
+            sample.append(batch)
+            if sum(map(len, sample)) >= self.init_size:
+                self.seed(sample)
+                sample = []
+        
+        if self.centers is None:
+            self.seed(sample)
+        return self
+    
+    def seed(self, sample):
+        """
+        Choose the initial centers among the values of a list of batches, and
+        train on them.
+        """
+        values = vstack(sample) if len(sample) > 0 else ()
+        if len(values) < self.k:
+            raise Exception("At least %d values are needed, %d found" % (self.k, len(values)))
+        
+        if self.init == 'hierarchical':
+            self.centers = hierarchical_seeds(values, self.k)
+        else:
+            self.centers = kmeans_plus_plus(values, self.k, self.random)
+        for batch in sample:
+            self.partial_fit(batch)
+    
+    def partial_fit(self, values):
+        """
+        Update the centers with a batch of Items or an array of values.
+        """
+        values = as_values(values)
+        if len(values) == 0: return
+        if self.centers is None:
+            return self.seed([values])
+        
+        labels = self.predict(values)
+        counts = bincount(labels, minlength=self.k)
+        sums = zeros(self.centers.shape)
+        for dimension in range(values.shape[1]):
+            sums[:, dimension] = bincount(labels, values[:, dimension], minlength=self.k)
+        
+        self.counts += counts
+        assigned = counts > 0
+        self.centers[assigned] += (sums[assigned] - counts[assigned, None] * self.centers[assigned]) / self.counts[assigned, None]
+    
+    def predict(self, values):
+        """
+        Index of the closest center of each value.
+        """
+        if self.centers is None:
+            raise Exception("Unable to predict without a model")
+        return argmin(squared_distances(as_values(values), self.centers), axis=1)
+    
+    def groups(self, items=(), clusters_names=None):
+        """
+        One Group per center, with the given items assigned to the closest one,
+        sorted like find_clusters and named by clusters_names.
+        """
+        members = [[] for _ in range(self.k)]
+        if len(items) > 0:
+            for item, label in zip(items, self.predict(items)):
+                members[label].append(item)
+        
+        groups = [Group(group, center) for group, center in zip(members, self.centers)]
+        groups.sort(reverse=True)
+        for group, cluster_name in zip(groups, clusters_names or ()):
+            group.name = cluster_name
+        return groups
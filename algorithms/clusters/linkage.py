@@ -0,0 +1,256 @@
+from numpy import arange, argmin, flatnonzero, inf, maximum, minimum, ones, sqrt, where, zeros
+
+from distances import as_values, pairwise_distances
+
+
+# Lance-Williams update of the distance of every cluster k from the union of
+# the clusters i and j, from d(k, i), d(k, j) and d(i, j):
+#     d(k, i+j) = ai * d(k, i) + aj * d(k, j) + b * d(i, j) + g * |d(k, i) - d(k, j)|
+# ward and centroid work on the squared euclidean distances.
+def single_update(dki, dkj, dij, ni, nj, nk):
+    return minimum(dki, dkj)
+
+
+def complete_update(dki, dkj, dij, ni, nj, nk):
+    return maximum(dki, dkj)
+
+
+def average_update(dki, dkj, dij, ni, nj, nk):
+    return (ni * dki + nj * dkj) / (ni + nj)
+
+
+def ward_update(dki, dkj, dij, ni, nj, nk):
+    return ((ni + nk) * dki + (nj + nk) * dkj - nk * dij) / (ni + nj + nk)
+
+
+def centroid_update(dki, dkj, dij, ni, nj, nk):
+    return (ni * dki + nj * dkj) / (ni + nj) - ni * nj * dij / (ni + nj) ** 2
+
+
+UPDATES = {
+    'single': single_update,
+    'complete': complete_update,
+    'average': average_update,
+    'ward': ward_update,
+    'centroid': centroid_update,
+}
+
+SQUARED = set(['ward', 'centroid'])
+
+# the distance from a union is never smaller than the distance between its
+# parts: the nearest-neighbor chain finds the same merges
+REDUCIBLE = set(['single', 'complete', 'average', 'ward'])
+
+
+class CondensedMatrix:
+    """
+    Symmetric distances of n clusters, stored as the upper triangle in a flat
+    array: d(i, j) = values[n*i - i*(i+1)/2 + j - i - 1] for i < j.
+    """
+    def __init__(self, n, values):
+        self.n = n
+        self.values = values
+        self.columns = arange(n)
+        self.starts = n * self.columns - self.columns * (self.columns + 1) // 2 - self.columns - 1
+    
+    def indexes(self, k):
+        """
+        Positions in values of the distances of k from every cluster, the one
+        of k itself is not meaningful.
+        """
+        j = self.columns
+        return where(j < k, self.starts + k, self.starts[k] + j)
+    
+    def row(self, k):
+        return self.values[self.indexes(k)]
+    
+    def set_row(self, k, row, mask):
+        self.values[self.indexes(k)[mask]] = row[mask]
+
+
+def linkage(values, method='centroid', dtype='float64', memory_limit=None, path=None):
+    """
+    Agglomerative clustering of the rows of an (n, d) array of values (or of
+    a list of Items).
+    
+    Return the full merge tree, as an (n-1) x 4 array of the merges in the
+    order they happen: [a, b, distance, size] merges the clusters a and b in a
+    cluster of size items. The items are the clusters 0..n-1, the cluster
+    created by the i-th merge is n+i. The tree can be cut at any number of
+    clusters, or distance, with cluster_labels(). Single, complete, average and ward linkage use the nearest-neighbor
+    chain, centroid linkage the closest pair of every cluster: both need the
+    O(n^2) distances, and O(n^2) time (in practice for centroid).
+    
+    The distances are kept in dtype (float32 halves the memory), if they are
+    larger than memory_limit bytes, or path is given, in a memory-mapped file
+    (see distances.pairwise_distances).
+    """
+    if method not in UPDATES:
+        raise Exception("Unknown linkage method: %s" % method)
+    
+    values = as_values(values, dtype)
+    n = len(values)
+    if n < 2:
+        return zeros((0, 4))
+    
+    squared = method in SQUARED
+    matrix = CondensedMatrix(n, pairwise_distances(values, squared, dtype, path=path, memory_limit=memory_limit))
+    
+    if method in REDUCIBLE:
+        merges = nn_chain(matrix, UPDATES[method])
+        merges.sort(key=lambda merge: merge[2]) # stable: a cluster is created before it is merged
+    else:
+        merges = closest_pairs(matrix, UPDATES[method])
+    
+    tree = label(n, merges)
+    if squared:
+        tree[:, 2] = sqrt(maximum(tree[:, 2], 0.0))
+    return tree
+
+
+def merge_rows(matrix, update, sizes, active, i, j, dij):
+    """
+    Merge cluster j into the slot of cluster i, return the masked row of the
+    new cluster: inf for itself and for the clusters that have been merged.
+    """
+    row = update(matrix.row(i), matrix.row(j), dij, sizes[i], sizes[j], sizes)
+    sizes[i] += sizes[j]
+    active[j] = False
+    mask = active.copy()
+    mask[i] = False
+    matrix.set_row(i, row, mask)
+    row[~mask] = inf
+    return row
+
+
+def masked_row(matrix, active, k):
+    row = matrix.row(k)
+    row[~active] = inf
+    row[k] = inf
+    return row
+
+
+def nn_chain(matrix, update):
+    """
+    Merges as (slot a, slot b, distance), the merged cluster keeps the slot b.
+    They are not in order of distance.
+    """
+    n = matrix.n
+    sizes = ones(n)
+    active = ones(n, dtype=bool)
+    merges, chain = [], []
+    while len(merges) < n - 1:
+        if len(chain) == 0:
+            chain.append(int(argmin(~active)))
+        
+        while True:
+            x = chain[-1]
+            row = masked_row(matrix, active, x)
+            y = int(argmin(row))
+            if len(chain) > 1 and row[chain[-2]] <= row[y]:
+                y = chain[-2] # prefer the previous cluster on ties
+            if len(chain) > 1 and y == chain[-2]:
+                break
+            chain.append(y)
+        
+        x, y = chain.pop(), chain.pop()
+        dxy = row[y]
+        merge_rows(matrix, update, sizes, active, y, x, dxy)
+        merges.append((x, y, dxy))
+    return merges
+
+
+def closest_pairs(matrix, update):
+    """
+    Merges as (slot a, slot b, distance) in order, merging every time the
+    closest pair of clusters. The nearest neighbor of every cluster is kept,
+    and recomputed only when it is merged or gets farther.
+    """
+    n = matrix.n
+    sizes = ones(n)
+    active = ones(n, dtype=bool)
+    nearest, distances = zeros(n, dtype='int64'), zeros(n)
+    
+    def refresh(k):
+        row = masked_row(matrix, active, k)
+        nearest[k] = argmin(row)
+        distances[k] = row[nearest[k]]
+    
+    for k in range(n):
+        refresh(k)
+    
+    merges = []
+    for _ in range(n - 1):
+        i = int(argmin(distances))
+        j, dij = int(nearest[i]), distances[i]
+        i, j = min(i, j), max(i, j)
+        merges.append((i, j, dij))
+        
+        row = merge_rows(matrix, update, sizes, active, i, j, dij)
+        distances[j] = inf
+        for k in where(active & ((nearest == i) | (nearest == j)))[0]:
+            refresh(k)
+        closer = row < distances
+        nearest[closer] = i
+        distances[closer] = row[closer]
+    return merges
+
+
+def label(n, merges):
+    """
+    From merges of slots, where each slot is one of the items of the
+    cluster, to the merge tree of cluster ids.
+    """
+    parents = arange(2 * n - 1)
+    sizes = ones(2 * n - 1)
+    
+    def find(x):
+        root = x
+        while parents[root] != root:
+            root = parents[root]
+        while parents[x] != root:
+            parents[x], x = root, parents[x]
+        return root
+    
+    tree = zeros((len(merges), 4))
+    for i, (a, b, distance) in enumerate(merges):
+        a, b = find(a), find(b)
+        parents[a] = parents[b] = n + i
+        sizes[n + i] = sizes[a] + sizes[b]
+        tree[i] = min(a, b), max(a, b), distance, sizes[n + i]
+    return tree
+
+
+def merges_for_count(tree, num_clusters):
+    """
+    Number of merges that leave num_clusters clusters.
+    """
+    return min(max(len(tree) + 1 - num_clusters, 0), len(tree))
+
+
+def merges_within(tree, max_distance):
+    """
+    Number of merges done before the first one farther than max_distance (with
+    centroid linkage the distances of the merges can decrease).
+    """
+    farther = flatnonzero(tree[:, 2] > max_distance)
+    return farther[0] if len(farther) > 0 else len(tree)
+
+
+def cluster_labels(tree, num_merges):
+    """
+    Cluster of every item after the first num_merges merges of the tree: an
+    array of ids, the same for the items of the same cluster.
+    """
+    n = len(tree) + 1
+    parents = arange(2 * n - 1)
+    merged = tree[:num_merges, :2].astype('int64')
+    parents[merged[:, 0]] = parents[merged[:, 1]] = arange(n, n + num_merges)
+    
+    # follow the parents up to the roots, doubling the steps every time
+    labels = parents
+    while True:
+        ancestors = labels[labels]
+        if (ancestors == labels).all(): break
+        labels = ancestors
+    return labels[:n]
@@ -0,0 +1,230 @@
+from heapq import heappop, heappush, heapreplace
+from numpy import arange, argmax, argpartition, argsort, array, asarray, inf, lexsort, maximum, minimum, sqrt, zeros
+
+from distances import as_values
+from kmeans import squared_distances
+from linkage import label
+
+
+class KDTree:
+    """
+    Nearest neighbors of the rows of an (n, d) array of values (or of a list
+    of Items): the values are split in two halves on the median of their
+    widest dimension, down to leaves of at most leaf_size values. A query
+    visits the nodes nearest first, and skips the ones whose bounding box is
+    farther than the neighbors found so far: O(log n) for low dimensions.
+    """
+    def __init__(self, values, leaf_size=16):
+        self.values = as_values(values)
+        self.leaf_size = leaf_size
+        self.indices = arange(len(self.values)) # values of the nodes, contiguous
+        
+        self.starts, self.ends, self.children = [], [], []
+        self.lowers, self.uppers = [], []
+        self.build(0, len(self.values))
+        self.lowers, self.uppers = asarray(self.lowers), asarray(self.uppers)
+    
+    def build(self, start, end):
+        node = len(self.starts)
+        points = self.values[self.indices[start:end]]
+        self.starts.append(start)
+        self.ends.append(end)
+        self.children.append(None)
+        if len(points) == 0:
+            self.lowers.append(zeros(self.values.shape[1]))
+            self.uppers.append(zeros(self.values.shape[1]))
+            return node
+        
+        lower, upper = points.min(axis=0), points.max(axis=0)
+        self.lowers.append(lower)
+        self.uppers.append(upper)
+        if end - start > self.leaf_size:
+            middle = (start + end) // 2
+            order = argpartition(points[:, argmax(upper - lower)], middle - start)
+            self.indices[start:end] = self.indices[start:end][order]
+            self.children[node] = (self.build(start, middle), self.build(middle, end))
+        return node
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def box_distance(self, node, point):
+        outside = maximum(self.lowers[node] - point, 0) + maximum(point - self.uppers[node], 0)
+        return sqrt(outside.dot(outside))
+    
+    def query(self, point, k=1):
+        """
+        (distances, indexes) of the k values nearest to point, nearest first.
+        """
+        return self.nearest(asarray(point, dtype='float64').ravel(), k)
+    
+    def nearest(self, point, k):
+        best = [] # (-distance, index) of the nearest so far, the farthest first
+        nodes = [(0.0, 0)]
+        while len(nodes) > 0:
+            distance, node = heappop(nodes)
+            if len(best) == k and distance > -best[0][0]: break
+            
+            if self.children[node] is not None:
+                for child in self.children[node]:
+                    heappush(nodes, (self.box_distance(child, point), child))
+                continue
+            
+            indexes = self.indices[self.starts[node]:self.ends[node]]
+            distances = sqrt(((self.values[indexes] - point) ** 2).sum(axis=1))
+            for distance, index in zip(distances.tolist(), indexes.tolist()):
+                if len(best) < k:
+                    heappush(best, (-distance, index))
+                elif distance < -best[0][0]:
+                    heapreplace(best, (-distance, index))
+        
+        best.sort(reverse=True)
+        return array([-d for d, _ in best]), array([i for _, i in best], dtype='int64')
+    
+    def query_radius(self, point, radius):
+        """
+        (distances, indexes) of the values within radius from point, nearest
+        first.
+        """
+        point = asarray(point, dtype='float64').ravel()
+        found_distances, found_indexes = [], []
+        nodes = [0]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            if self.box_distance(node, point) > radius: continue
+            if self.children[node] is not None:
+                nodes.extend(self.children[node])
+                continue
+            
+            indexes = self.indices[self.starts[node]:self.ends[node]]
+            distances = sqrt(((self.values[indexes] - point) ** 2).sum(axis=1))
+            within = distances <= radius
+            found_distances.extend(distances[within])
+            found_indexes.extend(indexes[within])
+        
+        order = argsort(found_distances, kind='mergesort')
+        return array(found_distances)[order], array(found_indexes, dtype='int64')[order]
+    
+    def leaves(self):
+        return [node for node, children in enumerate(self.children) if children is None]
+    
+    def node_components(self, components):
+        """
+        Component of the values of each node, -1 if they are not all the same.
+        """
+        result = zeros(len(self.starts), dtype='int64')
+        for node in reversed(range(len(self.starts))): # children after their parent
+            if self.children[node] is None:
+                values = components[self.indices[self.starts[node]:self.ends[node]]]
+                same = len(values) > 0 and (values == values[0]).all()
+                result[node] = values[0] if same else -1
+            else:
+                left, right = self.children[node]
+                result[node] = result[left] if result[left] == result[right] else -1
+        return result
+    
+    def shortest_edges(self, components):
+        """
+        (distances, indexes) of the nearest value of every value among the
+        values of the other components (inf and -1 if there are none): exact
+        only for the value with the shortest edge out of each component, the
+        nodes farther than that edge are skipped.
+        
+        All the values of a leaf are searched at once, the nodes are visited
+        nearest first and skipped if the values are all of the same component.
+        """
+        node_components = self.node_components(components)
+        best_distances = zeros(len(self)) + inf
+        best_indexes = zeros(len(self), dtype='int64') - 1
+        component_distances = zeros(len(self)) + inf # shortest edge out of each component
+        for leaf in self.leaves():
+            points = self.indices[self.starts[leaf]:self.ends[leaf]]
+            if len(points) == 0: continue
+            values, point_components = self.values[points], components[points]
+            distances, indexes = best_distances[points], best_indexes[points]
+            
+            outside = maximum(maximum(self.lowers[leaf] - self.uppers, self.lowers - self.uppers[leaf]), 0)
+            boxes = sqrt((outside ** 2).sum(axis=1)).tolist()
+            nodes = [(0.0, 0)]
+            while len(nodes) > 0:
+                distance, node = heappop(nodes)
+                if distance > minimum(distances, component_distances[point_components]).max(): break
+                if node_components[node] != -1 and node_components[node] == node_components[leaf]: continue
+                
+                if self.children[node] is not None:
+                    for child in self.children[node]:
+                        heappush(nodes, (boxes[child], child))
+                    continue
+                
+                others = self.indices[self.starts[node]:self.ends[node]]
+                pairs = sqrt(maximum(squared_distances(values, self.values[others]), 0))
+                pairs[point_components[:, None] == components[others][None, :]] = inf
+                nearest = pairs.argmin(axis=1)
+                nearest_distances = pairs[arange(len(points)), nearest]
+                closer = nearest_distances < distances
+                distances[closer] = nearest_distances[closer]
+                indexes[closer] = others[nearest[closer]]
+                minimum.at(component_distances, point_components, distances)
+            
+            best_distances[points], best_indexes[points] = distances, indexes
+        return best_distances, best_indexes
+
+
+class GroupIndex:
+    """
+    Nearest Group of new items: the group with the closest centroid, or with
+    members the group of the closest of their items (as in single linkage).
+    """
+    def __init__(self, groups, members=False, leaf_size=16):
+        self.groups = groups
+        if members:
+            self.labels = [group for group in groups for _ in group.items]
+            values = [item.values for group in groups for item in group.items]
+        else:
+            self.labels = groups
+            values = [group.values for group in groups]
+        self.tree = KDTree(values, leaf_size)
+    
+    def predict(self, items):
+        """
+        Nearest Group of each Item (or row of an (n, d) array of values).
+        """
+        if len(self.tree) == 0:
+            raise Exception("Unable to predict without groups")
+        return [self.labels[self.tree.query(values, 1)[1][0]] for values in as_values(items)]
+
+
+def single_linkage(values, leaf_size=64):
+    """
+    Same merge tree of linkage.linkage(values, 'single'), built from the
+    minimum spanning tree of the values: Boruvka's algorithm joins every
+    component with its nearest one, found with a KDTree, in O(log n) rounds
+    without the O(n^2) pairwise distances.
+    """
+    tree = KDTree(values, leaf_size)
+    n = len(tree)
+    components = arange(n)
+    edges = []
+    while len(edges) < n - 1:
+        distances, indexes = tree.shortest_edges(components)
+        
+        # join every component with the nearest one, in order of distance, and
+        # skip the edges that close a cycle (on ties)
+        roots = arange(n)
+        def find(x):
+            while roots[x] != x:
+                roots[x] = x = roots[roots[x]]
+            return x
+        
+        shortest = {} # shortest edge out of every component
+        for a in lexsort((arange(n), distances)):
+            shortest.setdefault(components[a], a)
+        for a in sorted(shortest.values(), key=lambda a: (distances[a], a)):
+            ra, rb = find(components[a]), find(components[indexes[a]])
+            if ra != rb:
+                roots[ra] = rb
+                edges.append((a, indexes[a], distances[a]))
+        components = array([find(component) for component in components])
+    
+    edges.sort(key=lambda edge: edge[2])
+    return label(n, edges) if n > 1 else zeros((0, 4))
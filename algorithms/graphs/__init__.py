@@ -1,6 +1,6 @@
 from collections import defaultdict
-from copy import deepcopy
-from heapq import heappush, heappop
+
+from frontier import PriorityFrontier, QueueFrontier, StackFrontier
 
 
 class Graph:
@@ -31,6 +31,14 @@ class Graph:
     
     def edges(self, node):
         return self.node_edges[node].items()
+    
+    def compile(self, weights_dtype=None):
+        """
+        Read-only CSR representation of the graph (requires numpy), see
+        compiled.CompiledGraph.
+        """
+        from compiled import CompiledGraph
+        return CompiledGraph.from_graph(self, weights_dtype)
 
 
 class Path:
@@ -55,88 +63,104 @@ class Path:
         return len(self.nodes)
     
     def __str__(self):
-        return ' -> '.join(self.nodes)  + " (cost:%d, length:%d)" % (self.cost, self.length)
+        return ' -> '.join(map(str, self.nodes))  + " (cost:%d, length:%d)" % (self.cost, self.length)
 
 
 class GraphSearcher:
-    def _add_frontier(self, path):
-        self.frontier[path.end] = path
-        self._add_path(path)
+    """
+    Only the cost of the best path found to every node of the frontier, and
+    the previous node on that path, are kept: the Path is built only for the
+    goal, following the previous nodes back to the start.
     
-    def _add_path(self, path):
-        self.paths.append(path)
+    The order in which the nodes of the frontier are expanded is given by the
+    frontier of the implementations (see graphs.frontier).
+    """
+    def _add_frontier(self, node, previous, cost):
+        self.frontier[node] = cost
+        self.previous[node] = previous
+        self._add_node(node)
     
-    def _already_in_frontier(self, new_path, adjacent):
+    def _add_node(self, node):
+        self.nodes.push(node)
+    
+    def _already_in_frontier(self, node, previous, cost):
         pass
     
-    def _get_path(self):
+    def _new_frontier(self):
         raise Exception("GraphSearcher is an abstract class, use one of its implementations instead")
     
+    def _path(self, node, cost):
+        nodes = [node]
+        while self.previous[nodes[-1]] is not None:
+            nodes.append(self.previous[nodes[-1]])
+        nodes.reverse()
+        
+        path = Path(nodes[0])
+        path.nodes = nodes
+        path.cost = cost
+        return path
+    
     def search(self, graph, start, goal, heuristic=None, debug=False):
         self.goal = goal
         self.heuristic = heuristic
         
-        self.paths = []
-        self.frontier = {}
-        self._add_frontier(Path(start))
+        self.nodes = self._new_frontier()
+        self.frontier = {}  # cost of the path to the nodes of the frontier
+        self.previous = {}  # previous node in the path to the nodes found so far
+        self._add_frontier(start, None, 0)
         
         explored = set([])
         iterations = 0
-        while True:
+        while len(self.nodes) > 0:
+            s = self.nodes.pop()
             iterations += 1
-            path = self._get_path()
-            if path is None: return None
-            if debug: print path
+            cost = self.frontier.pop(s)
+            if debug: print self._path(s, cost)
             
-            s = path.end
             explored.add(s)
-            del self.frontier[s]
             if s == goal:
+                path = self._path(s, cost)
                 path.iterations = iterations
                 return path
             
-            for edge in graph.edges(s):
-                new_node = edge[0]
+            for new_node, edge_cost in graph.edges(s):
                 if new_node in explored: continue
                 
-                new_path = deepcopy(path)
-                new_path.add(edge)
-                
                 if new_node in self.frontier:
-                    self._already_in_frontier(new_path, new_node)
+                    self._already_in_frontier(new_node, s, cost + edge_cost)
                 else:
-                    self._add_frontier(new_path)
+                    self._add_frontier(new_node, s, cost + edge_cost)
+        return None
 
 
 class BreadthFirstSearcher(GraphSearcher):
-    def _get_path(self):
-        return self.paths.pop(0)
+    def _new_frontier(self):
+        return QueueFrontier()
 
 
 class DepthFirstSearcher(GraphSearcher):
-    def _get_path(self):
-        return self.paths.pop()
+    def _new_frontier(self):
+        return StackFrontier()
 
 
 class UniformCostSearcher(GraphSearcher):
-    def _add_path(self, path):
-        heappush(self.paths, (self._path_cost(path), path))
+    def _new_frontier(self):
+        return PriorityFrontier()
     
-    def _get_path(self):
-        return heappop(self.paths)[1] # (0:cost, 1:path)
+    def _add_node(self, node):
+        self.nodes.push(node, self._path_cost(node))
     
-    def _path_cost(self, path):
-        return path.cost
+    def _path_cost(self, node):
+        return self.frontier[node]
     
-    def _already_in_frontier(self, new_path, adjacent):
-        if self._path_cost(new_path) < self._path_cost(self.frontier[adjacent]):
-            del self.frontier[adjacent]
-            self._add_frontier(new_path)
+    def _already_in_frontier(self, node, previous, cost):
+        if cost < self.frontier[node]:
+            self._add_frontier(node, previous, cost)
 
 
 class AStarSearcher(UniformCostSearcher):
-    def _path_cost(self, path):
-        return path.cost + self.heuristic(path.end, self.goal)
+    def _path_cost(self, node):
+        return self.frontier[node] + self.heuristic(node, self.goal)
 
 
 def breadth_first_search(graph, start, end):
@@ -154,3 +178,121 @@ def uniform_cost_search(graph, start, end):
 def a_star_search(graph, start, end, heuristic):
     return AStarSearcher().search(graph, start, end, heuristic)
 
+
+def _join_paths(previous, forward, backward, cost):
+    """
+    Path from the start of the forward search to forward, then from backward
+    (adjacent to forward) to the start of the backward search.
+    """
+    nodes = [forward]
+    while previous[0][nodes[-1]] is not None:
+        nodes.append(previous[0][nodes[-1]])
+    nodes.reverse()
+    
+    nodes.append(backward)
+    while previous[1][nodes[-1]] is not None:
+        nodes.append(previous[1][nodes[-1]])
+    
+    path = Path(nodes[0])
+    path.nodes = nodes
+    path.cost = cost
+    return path
+
+
+def _single_node_path(node):
+    path = Path(node)
+    path.iterations = 1
+    return path
+
+
+def bidirectional_bfs(graph, start, end):
+    """
+    Breadth first search from both start and end (the edges are undirected),
+    a whole level at a time from the side with the smaller frontier: the two
+    searches meet in the middle, with a path of the fewest edges.
+    """
+    if start == end: return _single_node_path(start)
+    
+    previous = ({start: None}, {end: None})
+    costs = ({start: 0}, {end: 0})
+    levels = ({start: 0}, {end: 0})
+    frontiers = ([start], [end])
+    iterations = 0
+    while len(frontiers[0]) > 0 and len(frontiers[1]) > 0:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        other = 1 - side
+        
+        best, meeting = None, None
+        next_frontier = []
+        for node in frontiers[side]:
+            iterations += 1
+            for adjacent, edge_cost in graph.edges(node):
+                if adjacent in previous[other]:
+                    length = levels[side][node] + 1 + levels[other][adjacent]
+                    if best is None or length < best:
+                        best, meeting = length, (node, adjacent, costs[side][node] + edge_cost + costs[other][adjacent])
+                if adjacent in previous[side]: continue
+                
+                previous[side][adjacent] = node
+                costs[side][adjacent] = costs[side][node] + edge_cost
+                levels[side][adjacent] = levels[side][node] + 1
+                next_frontier.append(adjacent)
+        
+        if meeting is not None:
+            node, adjacent, cost = meeting
+            forward, backward = (node, adjacent) if side == 0 else (adjacent, node)
+            path = _join_paths(previous, forward, backward, cost)
+            path.iterations = iterations
+            return path
+        
+        if side == 0:
+            frontiers = (next_frontier, frontiers[1])
+        else:
+            frontiers = (frontiers[0], next_frontier)
+    return None
+
+
+def bidirectional_dijkstra(graph, start, end):
+    """
+    Uniform cost search from both start and end (the edges are undirected),
+    expanding every time the side with the cheapest node. The best path found
+    so far goes through an edge between the two searches: it is the shortest
+    when the cheapest nodes of the two frontiers cost together no less.
+    """
+    if start == end: return _single_node_path(start)
+    
+    previous = ({start: None}, {end: None})
+    costs = ({start: 0}, {end: 0})
+    frontiers = (PriorityFrontier(), PriorityFrontier())
+    frontiers[0].push(start, 0)
+    frontiers[1].push(end, 0)
+    explored = (set([]), set([]))
+    
+    best, meeting = None, None
+    iterations = 0
+    while len(frontiers[0]) > 0 and len(frontiers[1]) > 0:
+        top = (frontiers[0].peek(), frontiers[1].peek())
+        if best is not None and top[0] + top[1] >= best: break
+        
+        side = 0 if top[0] <= top[1] else 1
+        other = 1 - side
+        node = frontiers[side].pop()
+        explored[side].add(node)
+        iterations += 1
+        
+        for adjacent, edge_cost in graph.edges(node):
+            if adjacent in explored[side]: continue
+            
+            cost = costs[side][node] + edge_cost
+            if adjacent not in costs[side] or cost < costs[side][adjacent]:
+                costs[side][adjacent] = cost
+                previous[side][adjacent] = node
+                frontiers[side].push(adjacent, cost)
+            if adjacent in costs[other] and (best is None or cost + costs[other][adjacent] < best):
+                best = cost + costs[other][adjacent]
+                meeting = (node, adjacent) if side == 0 else (adjacent, node)
+    
+    if meeting is None: return None
+    path = _join_paths(previous, meeting[0], meeting[1], best)
+    path.iterations = iterations
+    return path
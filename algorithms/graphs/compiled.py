@@ -0,0 +1,141 @@
+from numpy import asarray, bincount, concatenate, cumsum, maximum, ones, zeros
+
+
+class CompiledGraph:
+    """
+    Read-only Graph in CSR layout: the nodes are interned to the ids 0..n-1,
+    the edges of the node with id i are
+    
+        targets[offsets[i]:offsets[i+1]]  ids of the adjacent nodes
+        weights[offsets[i]:offsets[i+1]]  costs of the edges
+    
+    names[i] is the node with id i, if names is None the nodes are the ids.
+    It has the same nodes() and edges() of Graph, so that it can be searched
+    in the same way.
+    """
+    def __init__(self, offsets, targets, weights, names=None):
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.names = names
+        self._ids = None
+    
+    @classmethod
+    def from_graph(cls, graph, weights_dtype=None, targets_dtype='int32'):
+        """
+        Compile a Graph, the edges of every node keep their order.
+        """
+        names = graph.nodes()
+        ids = dict((node, i) for i, node in enumerate(names))
+        degrees, targets, weights = [], [], []
+        for node in names:
+            edges = graph.edges(node)
+            degrees.append(len(edges))
+            for adjacent, cost in edges:
+                targets.append(ids[adjacent])
+                weights.append(cost)
+        
+        offsets = zeros(len(names) + 1, dtype='int64')
+        cumsum(degrees, out=offsets[1:])
+        return cls(offsets, asarray(targets, dtype=targets_dtype),
+                   asarray(weights, dtype=weights_dtype), names)
+    
+    @classmethod
+    def from_edges(cls, firsts, seconds, weights=None, num_nodes=None, names=None,
+                   weights_dtype=None, targets_dtype='int32'):
+        """
+        Compile the undirected edges between the ids firsts[i] and seconds[i],
+        of cost weights[i] (1 by default like Graph). If an edge is repeated
+        the last cost is kept. The edges of every node are sorted by id.
+        """
+        firsts, seconds = asarray(firsts, dtype='int64'), asarray(seconds, dtype='int64')
+        weights = ones(len(firsts), dtype='int64') if weights is None else asarray(weights, dtype=weights_dtype)
+        if num_nodes is None and names is not None:
+            num_nodes = len(names)
+        elif num_nodes is None:
+            num_nodes = int(max(firsts.max(), seconds.max())) + 1 if len(firsts) > 0 else 0
+        
+        sources, targets = concatenate([firsts, seconds]), concatenate([seconds, firsts])
+        weights = concatenate([weights, weights])
+        keys = sources * num_nodes + targets
+        order = keys.argsort()
+        keys = keys[order]
+        
+        # keep the last of the same edges (and one of the two halves of the loops)
+        starts = ones(len(keys), dtype=bool)
+        starts[1:] = keys[1:] != keys[:-1]
+        starts = starts.nonzero()[0]
+        if len(starts) < len(keys):
+            # the same edge in both directions has the same time, the last wins
+            m = len(firsts)
+            times = maximum.reduceat((order % m) * 2 + order // m, starts)
+            order = times // 2 + m * (times % 2)
+        sources, targets, weights = sources[order], targets[order], weights[order]
+        
+        offsets = zeros(num_nodes + 1, dtype='int64')
+        cumsum(bincount(sources, minlength=num_nodes), out=offsets[1:])
+        return cls(offsets, targets.astype(targets_dtype), weights, names)
+    
+    SNAPSHOT_MAGIC = 'GRAPHCSR'
+    SNAPSHOT_VERSION = 2
+    
+    def save(self, path):
+        """
+        Write the graph to a binary file: the CSR arrays and the names of the
+        nodes, as a storage.NameTable.
+        """
+        from algorithms.storage import NameTable, write_arrays
+        
+        arrays = {'offsets': self.offsets, 'targets': self.targets, 'weights': self.weights}
+        meta = {'names': None}
+        if self.names is not None:
+            names = self.names if isinstance(self.names, NameTable) else NameTable.from_names(self.names)
+            arrays.update(names.arrays('names'))
+            meta['names'] = names.kind
+        write_arrays(path, self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, meta, arrays)
+    
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a graph written by save(), with mmap its arrays, and its names,
+        are memory-mapped so that processes share the same pages: nodes are
+        looked up in the names without building a dict.
+        """
+        from algorithms.storage import NameTable, read_arrays
+        
+        version, meta, arrays = read_arrays(path, cls.SNAPSHOT_MAGIC, mmap)
+        if version != cls.SNAPSHOT_VERSION:
+            raise Exception("Unsupported graph version: %d" % version)
+        names = None
+        if meta['names'] is not None:
+            names = NameTable.from_arrays(meta['names'], arrays, 'names')
+        return cls(arrays['offsets'], arrays['targets'], arrays['weights'], names)
+    
+    @property
+    def ids(self):
+        """
+        Id of every node, None if the nodes are the ids (built when needed,
+        unless the names are a NameTable).
+        """
+        if self._ids is None and self.names is not None:
+            from algorithms.storage import name_ids
+            self._ids = name_ids(self.names)
+        return self._ids
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def nodes(self):
+        return range(len(self)) if self.names is None else list(self.names)
+    
+    def edges(self, node):
+        i = node if self.ids is None else self.ids[node]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        targets = self.targets[start:end].tolist()
+        if self.names is not None:
+            targets = [self.names[target] for target in targets]
+        return zip(targets, self.weights[start:end].tolist())
+    
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.targets.nbytes + self.weights.nbytes
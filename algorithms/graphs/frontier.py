@@ -0,0 +1,76 @@
+from collections import deque
+from heapq import heapify, heappop, heappush
+
+
+class QueueFrontier:
+    """
+    First in, first out: breadth first.
+    """
+    def __init__(self):
+        self.nodes = deque()
+    
+    def __len__(self):
+        return len(self.nodes)
+    
+    def push(self, node, priority=None):
+        self.nodes.append(node)
+    
+    def pop(self):
+        return self.nodes.popleft()
+
+
+class StackFrontier(QueueFrontier):
+    """
+    Last in, first out: depth first.
+    """
+    def pop(self):
+        return self.nodes.pop()
+
+
+class PriorityFrontier:
+    """
+    Lowest priority first, nodes with the same priority in order of insertion.
+    
+    Pushing a node again replaces its priority: the old heap entry is only
+    marked as stale, and skipped when popped. When the stale entries are more
+    than the nodes the heap is rebuilt, so that its size stays bounded by
+    twice the number of nodes.
+    """
+    def __init__(self):
+        self.heap = []      # (priority, insertion, node)
+        self.entries = {}   # current entry of every node
+        self.insertions = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __contains__(self, node):
+        return node in self.entries
+    
+    def push(self, node, priority):
+        entry = (priority, self.insertions, node)
+        self.insertions += 1
+        self.entries[node] = entry
+        heappush(self.heap, entry)
+        if len(self.heap) > 2 * len(self.entries) + 16:
+            self.compact()
+    
+    def pop(self):
+        while True:
+            entry = heappop(self.heap)
+            node = entry[2]
+            if self.entries.get(node) is entry:
+                del self.entries[node]
+                return node
+    
+    def peek(self):
+        """
+        Priority of the node that pop() returns next.
+        """
+        while self.entries.get(self.heap[0][2]) is not self.heap[0]:
+            heappop(self.heap)
+        return self.heap[0][0]
+    
+    def compact(self):
+        self.heap = self.entries.values()
+        heapify(self.heap)
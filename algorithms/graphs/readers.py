@@ -0,0 +1,75 @@
+import csv
+from array import array
+
+from compiled import CompiledGraph
+
+
+def number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def read_edges(source, delimiter=None, skip_header=False):
+    """
+    Lazily read the edges, (first, second) or (first, second, cost) like in
+    Graph, from a file path, a file object or an iterable of text lines: the
+    fields are split on whitespace, or on delimiter (e.g. ',' for CSV files).
+    Blank lines and lines starting with '#' are skipped.
+    """
+    if isinstance(source, basestring):
+        with open(source, 'rb') as f:
+            for edge in read_edges(f, delimiter, skip_header):
+                yield edge
+        return
+    
+    lines = iter(source)
+    if skip_header: next(lines, None)
+    if delimiter is None:
+        rows = (line.split() for line in lines)
+    else:
+        rows = csv.reader(lines, delimiter=delimiter, skipinitialspace=True)
+    
+    for fields in rows:
+        if len(fields) == 0 or fields[0].startswith('#'): continue
+        
+        if len(fields) == 2:
+            yield fields[0], fields[1]
+        elif len(fields) == 3:
+            yield fields[0], fields[1], number(fields[2])
+        else:
+            raise Exception("Invalid edge: %s" % ' '.join(fields))
+
+
+def load_graph(source, delimiter=None, skip_header=False, integer_ids=False, weights_dtype=None):
+    """
+    CompiledGraph of the edges read by read_edges: the nodes are interned as
+    they are read (with integer_ids the nodes are the numbers in the file),
+    and the edges are kept in compact arrays, not in Python objects.
+    The cost of the edges without one is 1.
+    """
+    ids = {}
+    firsts, seconds, weights = array('l'), array('l'), array('d')
+    integral = True
+    for edge in read_edges(source, delimiter, skip_header):
+        if integer_ids:
+            first, second = int(edge[0]), int(edge[1])
+        else:
+            first, second = ids.setdefault(edge[0], len(ids)), ids.setdefault(edge[1], len(ids))
+        firsts.append(first)
+        seconds.append(second)
+        
+        cost = edge[2] if len(edge) == 3 else 1
+        integral = integral and isinstance(cost, (int, long))
+        weights.append(cost)
+    
+    names = None
+    if not integer_ids:
+        names = [None] * len(ids)
+        for node, i in ids.iteritems():
+            names[i] = node
+    
+    if weights_dtype is None:
+        weights_dtype = 'int64' if integral else 'float64'
+    return CompiledGraph.from_edges(firsts, seconds, weights, names=names, weights_dtype=weights_dtype)
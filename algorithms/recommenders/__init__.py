@@ -1,5 +1,10 @@
+import cPickle as pickle
+from array import array
 from collections import defaultdict
-from metrics import pearson_metric, euclidean_metric
+from heapq import nlargest
+from itertools import chain, izip
+from multiprocessing import Pool, cpu_count
+from metrics import pearson_metric, euclidean_metric, batch_metric, METRICS
 
 """ Example Data:
 KEYS = {
@@ -9,17 +14,74 @@ KEYS = {
 }
 """
 
-def similarity(data, a, b, metric=pearson_metric):
+def co_ratings(ratings_a, ratings_b):
+    """
+    Ratings given to the common subset of features, as two aligned sequences
+    """
+    if hasattr(ratings_a, 'co_ratings'):
+        # sparse rows intersect their sorted feature ids
+        return ratings_a.co_ratings(ratings_b)
+    
+    features = set(ratings_a.keys()) & set(ratings_b.keys())
+    return ([ratings_a[feature] for feature in features],
+            [ratings_b[feature] for feature in features])
+
+
+def similarity(data, a, b, metric=pearson_metric, cache=None):
+    if cache is not None:
+        return cache.get(a, b, lambda: similarity(data, a, b, metric))
+    
     # Get the common subset of features
-    features = set(data[a].keys()) & set(data[b].keys())
-    if len(features) == 0: return 0
+    X, Y = co_ratings(data[a], data[b])
+    if len(X) == 0: return 0
+    
+    return metric(X, Y)
+
+
+def co_rating_stats(data, a):
+    """
+    Sums over the features co-rated by a and every key (see metrics), as
+    arrays aligned with data.keys()
+    """
+    if hasattr(data, 'co_rating_stats'):
+        return data.co_rating_stats(a)
     
-    return metric([data[a][feature] for feature in features],
-                  [data[b][feature] for feature in features])
+    stats = [[], [], [], [], [], []]
+    ratings_a = data[a]
+    for b in data.keys():
+        X, Y = co_ratings(ratings_a, data[b])
+        for values, value in zip(stats, (len(X), sum(X), sum(Y),
+                                         sum([x**2 for x in X]), sum([y**2 for y in Y]),
+                                         sum([x*y for x, y in zip(X, Y)]))):
+            values.append(value)
+    return stats
+
+
+def batch_similarities(data, a, metric=pearson_metric):
+    """
+    Similarity of a with every key in one pass, as an array aligned with
+    data.keys(), or None if the metric has no batch kernel
+    """
+    kernel = batch_metric(metric)
+    if kernel is None: return None
+    return kernel(*co_rating_stats(data, a))
 
 
-def similar_keys(data, a, metric=pearson_metric):
-    scores = [(similarity(data, a, b, metric), b) for b in data.keys() if b != a]
+def similar_keys(data, a, metric=pearson_metric, candidates=None, cache=None):
+    """
+    Keys sorted by similarity with a, only among the candidates if given.
+    The cache is used only when the similarities are computed pair by pair.
+    """
+    if candidates is not None:
+        scores = [(similarity(data, a, b, metric, cache), b) for b in candidates if b != a]
+        scores.sort(reverse=True)
+        return scores
+    
+    similarities = batch_similarities(data, a, metric)
+    if similarities is None:
+        scores = [(similarity(data, a, b, metric, cache), b) for b in data.keys() if b != a]
+    else:
+        scores = [(s, b) for s, b in zip(similarities.tolist(), data.keys()) if b != a]
     scores.sort(reverse=True)
     return scores
 
@@ -34,28 +96,43 @@ class WeightedRanking:
         self.weigth_sum[f] += weight
     
     def get_weighted_rankings(self):
+        """
+        Weighted average of the rankings of every f, without the ones whose
+        weights sum to 0 (e.g. all their similarities are 0).
+        """
         rankings = [(ranking / self.weigth_sum[f], f)
-                    for f, ranking in self.ranking_sum.items()]
+                    for f, ranking in self.ranking_sum.items()
+                    if self.weigth_sum[f] != 0]
         rankings.sort(reverse=True)
         return rankings
 
 
-def recommend(data, a, metric=pearson_metric):
+def recommend(data, a, metric=pearson_metric, cache=None):
     """
     calculate ratings for unrated features of a key as average of all the other
     ratings for that feature weighted by the similarity of the other key
     """
+    ratings_a = data[a]
+    keys = data.keys()
+    
+    similarities = batch_similarities(data, a, metric)
+    if similarities is None:
+        similarities = [similarity(data, a, b, metric, cache) if b != a else 0 for b in keys]
+    elif hasattr(data, 'weighted_rankings'):
+        return data.weighted_rankings(a, similarities)
+    else:
+        similarities = similarities.tolist()
+    
     wr = WeightedRanking()
-    for b in data.keys():
+    for b, key_sim in zip(keys, similarities):
         # only different keys
         if b == a: continue
         
-        key_sim = similarity(data, a, b, metric)
         if key_sim <= 0: continue
         
-        for f in data[b]:
-            if f in data[a]: continue
-            wr.add_ranking(f, data[b][f], key_sim)
+        for f, rating in data[b].items():
+            if f in ratings_a: continue
+            wr.add_ranking(f, rating, key_sim)
     
     return wr.get_weighted_rankings()
 
@@ -65,76 +142,486 @@ def subset(results, limit):
     return results[0:limit]
 
 
+class Neighbors:
+    """
+    Items sorted by similarity, as two parallel arrays: iterating gives the
+    (similarity, item) pairs.
+    """
+    def __init__(self, row):
+        self.similarities = array('d', [s for s, _ in row])
+        self.items = tuple([item for _, item in row])
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def __iter__(self):
+        return izip(self.similarities, self.items)
+    
+    def __getitem__(self, i):
+        return (self.similarities[i], self.items[i])
+
+
+def add_sums(stats, x, y):
+    stats[0] += 1
+    stats[1] += x
+    stats[2] += y
+    stats[3] += x**2
+    stats[4] += y**2
+    stats[5] += x*y
+
+
+class ItemSimilarities:
+    """
+    For every item, the other items co-rated with it sorted by similarity.
+    Items that were never rated together have similarity 0 and are not listed.
+    The neighborhood can be bounded to the top neighbors items, and/or to the
+    items with similarity >= min_similarity.
+    
+    When the metric has a batch kernel and the ratings are dict-of-dicts, the
+    row of an item is scored from its co-rating sums with the other items
+    (see metrics), gathered from the ratings of its users. With incremental
+    the index keeps the sums of each pair of co-rated items:
+        stats[item_a][item_b] = [n, sumX, sumY, sumXSq, sumYSq, pSum]
+    so that a new rating only updates the sums of the items rated by the same
+    user, and only their rows are recomputed (the memory grows with the pairs
+    of co-rated items). The sums of those pairs are
+    recomputed from the ratings, not updated by adding and subtracting the
+    rating: the rounding errors would not cancel out.
+    """
+    def __init__(self, users, items, metric=pearson_metric, neighbors=None, min_similarity=None,
+                 incremental=False):
+        self.users = users
+        self.items = items
+        self.metric = metric
+        self.neighbors = neighbors
+        self.min_similarity = min_similarity
+        self.kernel = batch_metric(metric)
+        self.rows = {}
+        
+        self.stats = None
+        if incremental and self.kernel is not None and isinstance(items, dict):
+            self.stats = defaultdict(dict)
+            for ratings in users.values():
+                # count each pair of items once
+                previous = {}
+                for item, rating in ratings.items():
+                    self.add(previous, item, rating)
+                    previous[item] = rating
+        
+        for item in items.keys():
+            self.refresh(item)
+    
+    def add(self, ratings, item, rating):
+        # ratings: the other ratings given by the same user
+        for other, other_rating in ratings.items():
+            if other == item: continue
+            self._add_pair(item, other, rating, other_rating)
+            self._add_pair(other, item, other_rating, rating)
+    
+    def _add_pair(self, a, b, x, y):
+        add_sums(self.stats[a].setdefault(b, [0, 0, 0, 0, 0, 0]), x, y)
+    
+    def item_stats(self, item):
+        """
+        Co-rating sums of item with every item co-rated with it, from the
+        ratings of its users.
+        """
+        stats = {}
+        for user, x in self.items[item].items():
+            for other, y in self.users[user].items():
+                if other == item: continue
+                add_sums(stats.setdefault(other, [0, 0, 0, 0, 0, 0]), x, y)
+        return stats
+    
+    def update(self, ratings, item):
+        """
+        Recompute the sums of item with the items of ratings (the ones rated
+        by the user whose rating of item changed), after the change.
+        """
+        for other in ratings:
+            if other == item: continue
+            X, Y = co_ratings(self.items.get(item, {}), self.items.get(other, {}))
+            if len(X) == 0:
+                self.stats[item].pop(other, None)
+                self.stats[other].pop(item, None)
+                continue
+            
+            sums = [len(X), sum(X), sum(Y), sum([x**2 for x in X]), sum([y**2 for y in Y]),
+                    sum([x*y for x, y in zip(X, Y)])]
+            self.stats[item][other] = sums
+            self.stats[other][item] = [sums[0], sums[2], sums[1], sums[4], sums[3], sums[5]]
+    
+    def refresh(self, item):
+        """
+        Recompute the row of an item.
+        """
+        if item not in self.items:
+            self.rows.pop(item, None)
+            if self.stats is not None: self.stats.pop(item, None)
+            return
+        
+        if self.kernel is not None and isinstance(self.items, dict):
+            stats = self.stats[item] if self.stats is not None else self.item_stats(item)
+            others = stats.keys()
+            scores = self.kernel(*zip(*stats.values())).tolist() if others else []
+            row = zip(scores, others)
+        elif self.kernel is not None:
+            stats = co_rating_stats(self.items, item)
+            row = [(s, b) for s, n, b in zip(self.kernel(*stats).tolist(), stats[0], self.items.keys())
+                   if n > 0 and b != item]
+        else:
+            row = [(similarity(self.items, item, b, self.metric), b) for b in self.items.keys()
+                   if b != item and len(co_ratings(self.items[item], self.items[b])[0]) > 0]
+        
+        if self.min_similarity is not None:
+            row = [(s, b) for s, b in row if s >= self.min_similarity]
+        
+        if self.neighbors is None:
+            row.sort(reverse=True)
+        else:
+            # partial selection of the top neighbors, in O(n log(neighbors))
+            row = nlargest(self.neighbors, row)
+        self.rows[item] = Neighbors(row)
+
+
+# Model shared with the worker processes of recommend_all: it is inherited
+# through fork, the workers only read it
+worker_model = None
+
+def init_worker(model):
+    global worker_model
+    worker_model = model
+
+
+def worker_recommendations(args):
+    user, limit, mode = args
+    return user, worker_model.recommendations(user, limit, mode)
+
+
 class PreferencesModel:
-    def __init__(self, data, metric=pearson_metric):
+    """
+    The ratings are kept both by user and by item, either as dict-of-dicts or,
+    with sparse=True, as CSR matrices of interned ids (it requires numpy and
+    the model is read-only, but it takes a fraction of the memory per rating).
+    
+    Item based recommendations look at the neighbors most similar items of
+    each rated item (all the co-rated items if None) that have a similarity of
+    at least min_similarity.
+    
+    The item neighborhoods take memory linear in the number of items, if
+    neighbors is bounded. With incremental=True the co-rating sums of every
+    pair of co-rated items are also kept (see ItemSimilarities), so that
+    add_rating and remove_rating recompute the rows of the changed items from
+    them, instead of from the ratings of their users.
+    
+    With a cache_size, the similarities computed pair by pair (metrics without
+    a batch kernel, LSH candidates) are kept in LRU caches of that size.
+    
+    When a user rates the same item more than once, the last rating wins
+    (duplicates='last') or the ratings are averaged (duplicates='mean').
+    """
+    def __init__(self, data, metric=pearson_metric, sparse=False, neighbors=None, min_similarity=None,
+                 cache_size=None, duplicates='last', incremental=False):
+        if duplicates not in ('last', 'mean'):
+            raise Exception("Unknown duplicates policy: %s" % duplicates)
         self.metric = metric
         
-        self.users = defaultdict(dict)
-        self.items = defaultdict(dict)
-        for user, ratings in data:
-            for item, rating in ratings:
-                self.users[user][item] = rating
-                self.items[item][user] = rating
+        self.user_cache = None
+        self.item_cache = None
+        if cache_size is not None:
+            from cache import SimilarityCache
+            self.user_cache = SimilarityCache(cache_size)
+            self.item_cache = SimilarityCache(cache_size)
+        
+        if sparse:
+            from sparse import SparseRatings
+            self.users = SparseRatings.from_triples(((user, item, rating)
+                                                     for user, ratings in data
+                                                     for item, rating in ratings), duplicates)
+            self.items = self.users.transpose()
+        else:
+            self.users = defaultdict(dict)
+            self.items = defaultdict(dict)
+            counts = {} # number of ratings of the duplicated (user, item)
+            for user, ratings in data:
+                for item, rating in ratings:
+                    if duplicates == 'mean' and item in self.users[user]:
+                        count = counts[user, item] = counts.get((user, item), 1) + 1
+                        previous = self.users[user][item]
+                        rating = previous + (rating - previous) / float(count)
+                    self.users[user][item] = rating
+                    self.items[item][user] = rating
+        
+        self.item_index = ItemSimilarities(self.users, self.items, metric, neighbors, min_similarity, incremental)
+        self.item_similars = self.item_index.rows
+        
+        self.user_lsh = None
+        self.item_lsh = None
+    
+    @classmethod
+    def from_ratings(cls, source, delimiter=',', skip_header=False, progress=None, progress_every=100000,
+                     **options):
+        """
+        Build a model streaming flat (user, item, rating) rows, from a CSV/TSV
+        file (path or file object), from an iterable of its text lines or from
+        any iterable of (user, item, rating) rows, without grouping them by
+        user first. progress(rows) reports the rows read (see
+        readers.count_rows), the other options are the ones of the constructor.
+        """
+        from readers import count_rows, read_ratings
+        if isinstance(source, basestring) or hasattr(source, 'read'):
+            source = read_ratings(source, delimiter, skip_header)
+        else:
+            source = iter(source)
+            first = next(source, None)
+            if first is not None:
+                source = chain([first], source)
+            if isinstance(first, basestring):
+                source = read_ratings(source, delimiter, skip_header)
+        
+        source = count_rows(source, progress, progress_every)
+        return cls(((user, ((item, rating),)) for user, item, rating in source), **options)
+    
+    def build_lsh_index(self, bands=20, rows=5, seed=0):
+        """
+        Index users and items with MinHash LSH (it requires numpy): similar_users
+        and similar_items then rank only the keys that share a band with the
+        query, instead of scanning all of them.
+        """
+        from lsh import MinHashIndex
+        self.user_lsh = MinHashIndex(self.users, bands, rows, seed)
+        self.item_lsh = MinHashIndex(self.items, bands, rows, seed)
+    
+    # Snapshots
+    SNAPSHOT_MAGIC = 'PREFMODL'
+    SNAPSHOT_VERSION = 3
+    
+    def save(self, path):
+        """
+        Write the model to a binary file: the interned user and item ids (as
+        storage.NameTables), the CSR ratings by user and by item, and the item
+        neighbors.
+        """
+        from algorithms.storage import NameTable, write_arrays
+        from sparse import SparseRatings, NeighborTable
+        
+        users = self.users
+        if not isinstance(users, SparseRatings):
+            users = SparseRatings.from_triples((user, item, rating)
+                                               for user, ratings in self.users.items()
+                                               for item, rating in ratings.items())
+        items = users.transpose()
+        neighbors = self.item_similars
+        if not isinstance(neighbors, NeighborTable):
+            neighbors = NeighborTable.from_rows(items.key_names, neighbors, items.key_ids)
         
-        self.item_similars = {}
-        for item in self.items.keys():
-            self.item_similars[item] = self.similar_items(item, None)
+        # the metrics of the metrics module are stored by name, the others are
+        # pickled, if they can be, and only unpickled on request
+        metric = metric_pickle = None
+        names = [name for name, known in METRICS.items() if known is self.metric]
+        if len(names) > 0:
+            metric = names[0]
+        else:
+            try:
+                metric_pickle = pickle.dumps(self.metric, pickle.HIGHEST_PROTOCOL)
+                pickle.loads(metric_pickle)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                metric_pickle = None # it has to be given to load()
+        
+        tables = {}
+        for name, names in (('users', users.key_names), ('items', items.key_names)):
+            tables[name] = names if isinstance(names, NameTable) else NameTable.from_names(names)
+        
+        meta = {
+            'users': tables['users'].kind,
+            'items': tables['items'].kind,
+            'metric': metric,
+            'metric_pickle': metric_pickle,
+            'neighbors': self.item_index.neighbors,
+            'min_similarity': self.item_index.min_similarity,
+        }
+        arrays = {
+            'users_indptr': users.indptr, 'users_indices': users.indices, 'users_values': users.values,
+            'items_indptr': items.indptr, 'items_indices': items.indices, 'items_values': items.values,
+            'neighbors_indptr': neighbors.indptr, 'neighbors_ids': neighbors.ids,
+            'neighbors_similarities': neighbors.similarities,
+        }
+        for name, table in tables.items():
+            arrays.update(table.arrays(name))
+        write_arrays(path, self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, meta, arrays)
+    
+    @classmethod
+    def load(cls, path, mmap=True, metric=None, cache_size=None, unpickle_metric=False):
+        """
+        Load a model written by save() as a read-only sparse model, with mmap
+        its arrays are memory-mapped so that processes share the same pages:
+        users and items are looked up in the mapped tables of names, without
+        building any dict. A metric that is not in metrics.METRICS has to be given, or, only for
+        trusted files, unpickled from the file with unpickle_metric.
+        """
+        from algorithms.storage import NameTable, read_arrays
+        from sparse import SparseRatings, NeighborTable
+        
+        version, meta, arrays = read_arrays(path, cls.SNAPSHOT_MAGIC, mmap)
+        if version != cls.SNAPSHOT_VERSION:
+            raise Exception("Unsupported model version: %d" % version)
+        if metric is None and meta['metric'] is not None:
+            metric = METRICS[meta['metric']]
+        if metric is None and unpickle_metric and meta['metric_pickle'] is not None:
+            metric = pickle.loads(meta['metric_pickle'])
+        if metric is None:
+            raise Exception("The metric of this model has to be given")
+        
+        model = cls((), metric, True, meta['neighbors'], meta['min_similarity'], cache_size)
+        users = NameTable.from_arrays(meta['users'], arrays, 'users')
+        items = NameTable.from_arrays(meta['items'], arrays, 'items')
+        model.users = SparseRatings(users, items, arrays['users_indptr'],
+                                    arrays['users_indices'], arrays['users_values'])
+        model.items = SparseRatings(items, users, arrays['items_indptr'],
+                                    arrays['items_indices'], arrays['items_values'])
+        model.users.transposed, model.items.transposed = model.items, model.users
+        
+        model.item_similars = NeighborTable(items, arrays['neighbors_indptr'],
+                                            arrays['neighbors_ids'], arrays['neighbors_similarities'])
+        model.item_index.users, model.item_index.items = model.users, model.items
+        model.item_index.rows = model.item_similars
+        return model
+    
+    def add_rating(self, user, item, rating):
+        """
+        Add, or replace, the rating of a user for an item.
+        """
+        self.remove_rating(user, item)
+        self.users[user][item] = rating
+        self.items[item][user] = rating
+        if self.item_index.stats is not None:
+            self.item_index.update(self.users[user], item)
+        self._refresh(user, item)
+    
+    def remove_rating(self, user, item):
+        """
+        Remove the rating of a user for an item, if any.
+        """
+        if not isinstance(self.users, dict):
+            raise Exception("Unable to change the ratings of a sparse model")
+        if user not in self.users or item not in self.users[user]: return
+        
+        del self.users[user][item]
+        del self.items[item][user]
+        if self.item_index.stats is not None:
+            self.item_index.update(self.users[user], item)
+        
+        # drop the keys without ratings, as if they were never added
+        if len(self.users[user]) == 0: del self.users[user]
+        if len(self.items[item]) == 0: del self.items[item]
+        self._refresh(user, item)
+    
+    def _refresh(self, user, item):
+        # only the items co-rated by this user changed similarity with the item
+        self.item_index.refresh(item)
+        for other in self.users.get(user, ()):
+            if other != item: self.item_index.refresh(other)
+        
+        if self.user_lsh is not None:
+            self.user_lsh.update(user, self.users.get(user, ()))
+            self.item_lsh.update(item, self.items.get(item, ()))
+        
+        if self.user_cache is not None:
+            self.user_cache.invalidate(user)
+            self.item_cache.invalidate(item)
     
     # User based collaborative filtering
     def users_similarity(self, user_a, user_b):
         """
         How similar are these two users?
         """
-        return similarity(self.users, user_a, user_b, self.metric)
+        return similarity(self.users, user_a, user_b, self.metric, self.user_cache)
     
     def similar_users(self, user, limit=3):
         """
         Give me a list of users similar to this one.
         """
-        return subset(similar_keys(self.users, user, self.metric), limit)
+        candidates = self.user_lsh.candidates(user) if self.user_lsh is not None else None
+        return subset(similar_keys(self.users, user, self.metric, candidates, self.user_cache), limit)
     
     def user_based_recommendations(self, user, limit=3):
         """
         Suggest to this user a list of items he did not rate and that he could
         like, based on the ratings of users similar to him.
         """
-        return subset(recommend(self.users, user, self.metric), limit)
+        return subset(recommend(self.users, user, self.metric, self.user_cache), limit)
     
     # Item based collaborative filtering
     def items_similarity(self, item_a, item_b):
         """
         How similar are these two items?
         """
-        return similarity(self.items, item_a, item_b, self.metric)
+        return similarity(self.items, item_a, item_b, self.metric, self.item_cache)
     
     def similar_items(self, item, limit=3):
         """
         Give me a list of items similar to this one.
         """
-        return subset(similar_keys(self.items, item, self.metric), limit)
+        candidates = self.item_lsh.candidates(item) if self.item_lsh is not None else None
+        return subset(similar_keys(self.items, item, self.metric, candidates, self.item_cache), limit)
     
     def user_recommendations(self, item, limit=3):
         """
         Suggest a list of users that have not rated this item that could like
         it, based on the ratings of similar users.
         """
-        return subset(recommend(self.items, item, self.metric), limit)
+        return subset(recommend(self.items, item, self.metric, self.item_cache), limit)
+    
+    def recommendations(self, user, limit=3, mode='user'):
+        """
+        User based (mode='user') or item based (mode='item') recommendations.
+        """
+        if mode == 'user':
+            return self.user_based_recommendations(user, limit)
+        elif mode == 'item':
+            return self.item_based_recommendations(user, limit)
+        raise Exception("Unknown recommendations mode: %s" % mode)
+    
+    def recommend_all(self, users=None, limit=3, mode='user', workers=None, chunksize=64):
+        """
+        Generate (user, recommendations) for many users (all by default), in
+        order, splitting them among a pool of workers processes (one per CPU
+        by default) that share this model through fork.
+        """
+        if users is None: users = self.users.keys()
+        if workers is None: workers = cpu_count()
+        
+        if workers <= 1:
+            for user in users:
+                yield user, self.recommendations(user, limit, mode)
+            return
+        
+        pool = Pool(workers, init_worker, (self,))
+        try:
+            tasks = ((user, limit, mode) for user in users)
+            for result in pool.imap(worker_recommendations, tasks, chunksize):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
     
     def item_based_recommendations(self, user, limit=3):
         """
         Suggest to this user a list of items he did not rate and that he could
         like, based on the ratings he gave to similar to items.
         """
-        user_ratings = self.users[user]
+        user_ratings = self.users[user].items()
+        rated = set([item for item, _ in user_ratings])
         
         wr = WeightedRanking()
         
         # items rated by this user
-        for (item_a, rating) in user_ratings.items():
+        for (item_a, rating) in user_ratings:
             
             # items similar to this one
             for (item_sim, item_b) in self.item_similars[item_a]:
-                if item_b in user_ratings: continue
+                if item_b in rated: continue
                 wr.add_ranking(item_b, rating, item_sim)
         
         return subset(wr.get_weighted_rankings(), limit)
@@ -0,0 +1,60 @@
+from collections import defaultdict, OrderedDict
+
+
+class SimilarityCache:
+    """
+    Bounded cache of the similarity of pairs of keys, when it is full the
+    least recently used pair is evicted.
+    Similarity is symmetric: (a, b) and (b, a) share the same entry.
+    With size 0 every similarity is computed again.
+    """
+    def __init__(self, size=10000):
+        if size < 0:
+            raise Exception("Invalid cache size: %d" % size)
+        self.size = size
+        self.entries = OrderedDict() # from the least to the most recently used
+        self.key_pairs = defaultdict(set) # cached pairs of each key
+        
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def get(self, a, b, compute):
+        """
+        Similarity of a and b, compute() is called only on a cache miss.
+        """
+        pair = frozenset((a, b))
+        if pair in self.entries:
+            self.hits += 1
+            value = self.entries.pop(pair)
+        else:
+            self.misses += 1
+            value = compute()
+            if self.size == 0: return value # nothing is kept
+            if len(self.entries) >= self.size:
+                self._discard(self.entries.iterkeys().next())
+            for key in pair:
+                self.key_pairs[key].add(pair)
+        
+        self.entries[pair] = value
+        return value
+    
+    def _discard(self, pair):
+        del self.entries[pair]
+        for key in pair:
+            pairs = self.key_pairs[key]
+            pairs.discard(pair)
+            if len(pairs) == 0: del self.key_pairs[key]
+    
+    def invalidate(self, key):
+        """
+        Forget all the pairs of a key, when its ratings change.
+        """
+        for pair in list(self.key_pairs.get(key, ())):
+            self._discard(pair)
+    
+    def clear(self):
+        self.entries.clear()
+        self.key_pairs.clear()
@@ -0,0 +1,84 @@
+from collections import defaultdict
+from random import Random
+from numpy import array, uint32
+
+# Universal hashing: h(x) = (a * x + b) mod PRIME, with x < 2^32
+PRIME = (1 << 31) - 1
+
+
+class MinHashIndex:
+    """
+    Locality Sensitive Hashing of the sets of features rated by each key.
+    
+    The MinHash signature of a key is the minimum of bands * rows random hash
+    functions over its features: two keys have the same value for one of them
+    with probability equal to the Jaccard similarity J of their features.
+    Signatures are split in bands of rows values, and keys that share a whole
+    band are candidates: it happens with probability
+        1 - (1 - J^rows)^bands
+    Keys without co-rated features (J = 0, similarity 0) are never candidates.
+    """
+    def __init__(self, data, bands=20, rows=5, seed=0):
+        self.bands = bands
+        self.rows = rows
+        
+        random = Random(seed)
+        size = bands * rows
+        self.a = array([random.randint(1, PRIME - 1) for _ in range(size)], dtype='int64')[:, None]
+        self.b = array([random.randint(0, PRIME - 1) for _ in range(size)], dtype='int64')[:, None]
+        
+        self.signatures = {}
+        self.buckets = [defaultdict(set) for _ in range(bands)]
+        for key in data.keys():
+            self.update(key, data[key])
+    
+    def signature(self, features):
+        values = array([hash(f) for f in features], dtype='int64').astype(uint32).astype('int64')
+        return ((self.a * values + self.b) % PRIME).min(axis=1).astype('int32')
+    
+    def _bands(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tostring()
+    
+    def remove(self, key):
+        signature = self.signatures.pop(key, None)
+        if signature is None: return
+        
+        for band, bucket in self._bands(signature):
+            keys = self.buckets[band][bucket]
+            keys.discard(key)
+            if len(keys) == 0: del self.buckets[band][bucket]
+    
+    def update(self, key, features):
+        """
+        (Re)index a key with its rated features.
+        """
+        self.remove(key)
+        if len(features) == 0: return
+        
+        signature = self.signatures[key] = self.signature(features)
+        for band, bucket in self._bands(signature):
+            self.buckets[band][bucket].add(key)
+    
+    def candidates(self, key):
+        """
+        The keys that share at least a band with this one.
+        """
+        candidates = set([])
+        signature = self.signatures.get(key)
+        if signature is not None:
+            for band, bucket in self._bands(signature):
+                candidates.update(self.buckets[band].get(bucket, ()))
+            candidates.discard(key)
+        return candidates
+
+
+def recall_at_k(exact, approximate, k):
+    """
+    Fraction of the top k exact results (lists of (score, key)) that are also
+    among the top k approximate ones.
+    """
+    expected = set([key for _, key in exact[0:k]])
+    if len(expected) == 0: return 1.0
+    found = set([key for _, key in approximate[0:k]])
+    return len(expected & found) / float(len(expected))
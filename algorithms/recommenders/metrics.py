@@ -1,8 +1,14 @@
 # Metrics to measure how close two items are:
 # ~1: very close
 # ~0: very distant
+#
+# The batch kernels score one key against many others at once, from the sums
+# over the features co-rated by each pair (X: ratings of the key, Y: ratings of
+# the other key), given as sequences:
+#     n, sumX, sumY, sumXSq, sumYSq, pSum
+# pairs with no co-rated features (n == 0) have similarity 0
 try:
-    from numpy import array
+    from numpy import array, asarray, clip, errstate, isnan, maximum, sqrt
     from numpy.linalg import norm
     from scipy.stats import pearsonr
     
@@ -10,7 +16,32 @@ try:
         return 1.0 / (1.0 + norm(array(X) - array(Y)))
     
     def pearson_metric(X, Y):
-        return pearsonr(array(X), array(Y))[0]
+        with errstate(divide='ignore', invalid='ignore'):
+            r = pearsonr(array(X), array(Y))[0]
+        # no correlation can be measured on constant ratings (den == 0)
+        if isnan(r): return 0
+        return r
+    
+    def euclidean_batch(*stats):
+        n, sumX, sumY, sumXSq, sumYSq, pSum = [asarray(s, dtype=float) for s in stats]
+        scores = 1.0 / (1.0 + sqrt(maximum(sumXSq - 2 * pSum + sumYSq, 0)))
+        scores[n == 0] = 0
+        return scores
+    
+    def pearson_batch(*stats):
+        n, sumX, sumY, sumXSq, sumYSq, pSum = [asarray(s, dtype=float) for s in stats]
+        with errstate(divide='ignore', invalid='ignore'):
+            varX, varY = sumXSq - sumX**2 / n, sumYSq - sumY**2 / n
+            scores = clip((pSum - (sumX * sumY / n)) / sqrt(varX * varY), -1, 1)
+            # constant ratings, up to the rounding errors of the sums
+            constant = (varX <= 1e-12 * sumXSq) | (varY <= 1e-12 * sumYSq)
+            scores[(n < 2) | constant] = 0
+        return scores
+    
+    BATCH_METRICS = {
+        euclidean_metric: euclidean_batch,
+        pearson_metric: pearson_batch,
+    }
 
 except ImportError:
     from math import sqrt
@@ -35,3 +66,19 @@ except ImportError:
         if den == 0: return 0
         
         return (pSum - (sumX * sumY / n)) / den
+    
+    BATCH_METRICS = {}
+
+
+# metrics that can be stored by name in a snapshot
+METRICS = {
+    'euclidean_metric': euclidean_metric,
+    'pearson_metric': pearson_metric,
+}
+
+
+def batch_metric(metric):
+    """
+    The batch kernel of a metric, None if it has to be computed pair by pair
+    """
+    return BATCH_METRICS.get(metric)
@@ -0,0 +1,44 @@
+import csv
+
+
+def count_rows(rows, progress=None, progress_every=100000):
+    """
+    Yield the rows, progress(rows), if given, is called every progress_every
+    rows and with the total number of rows at the end.
+    """
+    count = 0
+    for row in rows:
+        yield row
+        
+        count += 1
+        if progress is not None and count % progress_every == 0:
+            progress(count)
+    
+    if progress is not None: progress(count)
+
+
+def read_ratings(source, delimiter=',', skip_header=False, progress=None, progress_every=100000):
+    """
+    Lazily read flat (user, item, rating) rows from a file path, a file object
+    or an iterable of text lines: use delimiter='\\t' for TSV files.
+    Blank lines and lines starting with '#' are skipped.
+    See count_rows for progress.
+    """
+    if isinstance(source, basestring):
+        with open(source, 'rb') as f:
+            for row in read_ratings(f, delimiter, skip_header, progress, progress_every):
+                yield row
+        return
+    
+    for row in count_rows(parse_ratings(source, delimiter, skip_header), progress, progress_every):
+        yield row
+
+
+def parse_ratings(lines, delimiter=',', skip_header=False):
+    lines = iter(lines)
+    if skip_header: next(lines, None)
+    for fields in csv.reader(lines, delimiter=delimiter, skipinitialspace=True):
+        if len(fields) == 0 or fields[0].startswith('#'): continue
+        
+        user, item, rating = fields
+        yield user, item, float(rating)
@@ -0,0 +1,301 @@
+from array import array
+from itertools import izip
+from algorithms.storage import name_ids
+from numpy import add, arange, asarray, bincount, concatenate, cumsum, diff, flatnonzero, intersect1d, lexsort, repeat, searchsorted, zeros
+
+
+class SparseRow:
+    """
+    Read-only view of the ratings of a single key: it behaves like the
+    {feature: rating} dictionary of the dict-of-dicts representation.
+    """
+    def __init__(self, matrix, indices, values):
+        self.matrix = matrix
+        self.indices = indices # feature ids, sorted
+        self.values = values
+    
+    def _position(self, feature):
+        fid = self.matrix.feature_ids.get(feature)
+        if fid is None: return None
+        pos = int(searchsorted(self.indices, fid))
+        if pos < len(self.indices) and self.indices[pos] == fid:
+            return pos
+        return None
+    
+    def __len__(self):
+        return len(self.indices)
+    
+    def __iter__(self):
+        names = self.matrix.feature_names
+        return (names[fid] for fid in self.indices.tolist())
+    
+    def __contains__(self, feature):
+        return self._position(feature) is not None
+    
+    def __getitem__(self, feature):
+        pos = self._position(feature)
+        if pos is None: raise KeyError(feature)
+        return float(self.values[pos])
+    
+    def get(self, feature, default=None):
+        pos = self._position(feature)
+        return default if pos is None else float(self.values[pos])
+    
+    def keys(self):
+        return list(self)
+    
+    def items(self):
+        return zip(self, self.values.tolist())
+    
+    def co_ratings(self, other):
+        """
+        Ratings given by both rows to their common subset of features.
+        """
+        common, a, b = intersect1d(self.indices, other.indices,
+                                   assume_unique=True, return_indices=True)
+        return self.values[a], other.values[b]
+
+
+class SparseRatings:
+    """
+    Ratings stored as a Compressed Sparse Row matrix.
+    
+    Keys and features are interned to integer ids, the ratings given by the
+    key with id i are values[indptr[i]:indptr[i+1]], and the ids of the rated
+    features are in indices (sorted). It is a read-only replacement for the
+    dict-of-dicts representation:
+        data[key][feature] -> rating
+    
+    The names can be lists or storage.NameTables, the {name: id} mappings
+    are built from them if they are not given.
+    """
+    def __init__(self, key_names, feature_names, indptr, indices, values, key_ids=None, feature_ids=None):
+        self.key_names = key_names
+        self.key_ids = name_ids(key_names) if key_ids is None else key_ids
+        self.feature_names = feature_names
+        self.feature_ids = name_ids(feature_names) if feature_ids is None else feature_ids
+        
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        
+        self.transposed = None
+    
+    @classmethod
+    def from_triples(cls, triples, duplicates='last'):
+        """
+        Build the matrix from an iterable of (key, feature, rating), when the
+        same (key, feature) appears more than once the last rating wins, or
+        with duplicates='mean' the ratings are averaged.
+        """
+        key_names, key_ids = [], {}
+        feature_names, feature_ids = [], {}
+        rows, cols, values = array('l'), array('l'), array('d')
+        for key, feature, rating in triples:
+            row = key_ids.get(key)
+            if row is None:
+                row = key_ids[key] = len(key_names)
+                key_names.append(key)
+            col = feature_ids.get(feature)
+            if col is None:
+                col = feature_ids[feature] = len(feature_names)
+                feature_names.append(feature)
+            rows.append(row)
+            cols.append(col)
+            values.append(rating)
+        
+        indptr, indices, data = compress(len(key_names), asarray(rows, 'int64'), asarray(cols, 'int64'),
+                                        asarray(values, 'float64'), duplicates)
+        return cls(key_names, feature_names, indptr, indices, data, key_ids, feature_ids)
+    
+    def transpose(self):
+        """
+        The same ratings indexed by feature (the CSC layout of this matrix).
+        """
+        if self.transposed is None:
+            rows = key_rows(self.indptr)
+            indptr, indices, values = compress(len(self.feature_names), self.indices, rows, self.values)
+            self.transposed = SparseRatings(self.feature_names, self.key_names, indptr, indices, values,
+                                            self.feature_ids, self.key_ids)
+            self.transposed.transposed = self
+        return self.transposed
+    
+    def row(self, i):
+        start, end = self.indptr[i], self.indptr[i+1]
+        return SparseRow(self, self.indices[start:end], self.values[start:end])
+    
+    def keys(self):
+        return list(self.key_names)
+    
+    def __len__(self):
+        return len(self.key_names)
+    
+    def __iter__(self):
+        return iter(self.key_names)
+    
+    def __contains__(self, key):
+        return key in self.key_ids
+    
+    def __getitem__(self, key):
+        i = self.key_ids.get(key)
+        if i is None:
+            # unknown keys have no ratings, as with a defaultdict(dict)
+            return SparseRow(self, self.indices[0:0], self.values[0:0])
+        return self.row(i)
+    
+    def co_rating_stats(self, key):
+        """
+        Sums over the features co-rated by key and every key, as arrays
+        indexed by key id: (n, sumX, sumY, sumXSq, sumYSq, pSum).
+        Only the ratings of the features rated by key are visited.
+        """
+        row = self[key]
+        by_feature = self.transpose()
+        positions, lengths = gather(by_feature.indptr, row.indices)
+        
+        others = by_feature.indices[positions]
+        X = repeat(row.values, lengths)
+        Y = by_feature.values[positions]
+        
+        size = len(self.key_names)
+        return (bincount(others, minlength=size).astype('float64'),
+                bincount(others, X, size),
+                bincount(others, Y, size),
+                bincount(others, X * X, size),
+                bincount(others, Y * Y, size),
+                bincount(others, X * Y, size))
+    
+    def weighted_rankings(self, key, similarities):
+        """
+        Vectorized version of recommend(): the ratings of the features not
+        rated by key, averaged over the keys with positive similarity.
+        """
+        similarities = similarities.copy()
+        if key in self.key_ids: similarities[self.key_ids[key]] = 0
+        similar = flatnonzero(similarities > 0)
+        positions, lengths = gather(self.indptr, similar)
+        
+        features = self.indices[positions]
+        weights = repeat(similarities[similar], lengths)
+        size = len(self.feature_names)
+        ranking_sum = bincount(features, weights * self.values[positions], size)
+        weight_sum = bincount(features, weights, size)
+        
+        rated = zeros(size, dtype=bool)
+        rated[self[key].indices] = True
+        candidates = flatnonzero((weight_sum > 0) & ~rated)
+        rankings = zip((ranking_sum[candidates] / weight_sum[candidates]).tolist(),
+                       [self.feature_names[f] for f in candidates.tolist()])
+        rankings.sort(reverse=True)
+        return rankings
+    
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.values.nbytes
+
+
+def key_rows(indptr):
+    """
+    Row id of every stored rating.
+    """
+    return repeat(arange(len(indptr) - 1), diff(indptr))
+
+
+def gather(indptr, ids):
+    """
+    Positions of the ratings of all the given rows, and the length of each row
+    """
+    starts = indptr[ids]
+    lengths = indptr[ids + 1] - starts
+    offsets = repeat(starts - (cumsum(lengths) - lengths), lengths)
+    return offsets + arange(offsets.size), lengths
+
+
+def compress(num_rows, rows, cols, values, duplicates='last'):
+    # sort by (row, col), the sort is stable so duplicates keep their order
+    order = lexsort((cols, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    
+    # keep the last (or the mean) of each run of duplicated (row, col)
+    if len(rows) > 0:
+        last = concatenate(((rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1]), [True]))
+        if duplicates == 'mean':
+            first = flatnonzero(concatenate(([True], last[:-1])))
+            values = add.reduceat(values, first) / diff(concatenate((first, [len(values)])))
+            rows, cols = rows[last], cols[last]
+        else:
+            rows, cols, values = rows[last], cols[last], values[last]
+    
+    indptr = zeros(num_rows + 1, dtype='int64')
+    cumsum(bincount(rows, minlength=num_rows), out=indptr[1:])
+    return indptr, cols.astype('int32'), values.astype('float64')
+
+
+class SparseNeighbors:
+    """
+    Read-only view of the neighbors of an item in a NeighborTable.
+    """
+    def __init__(self, names, ids, similarities):
+        self.names = names
+        self.ids = ids
+        self.similarities = similarities
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __iter__(self):
+        names = self.names
+        return izip(self.similarities.tolist(), [names[i] for i in self.ids.tolist()])
+    
+    def __getitem__(self, i):
+        return (float(self.similarities[i]), self.names[self.ids[i]])
+
+
+class NeighborTable:
+    """
+    Read-only item -> neighbors mapping stored as CSR arrays: the neighbors of
+    the item with id i are ids[indptr[i]:indptr[i+1]], their similarities are
+    in similarities, with the same layout.
+    """
+    def __init__(self, names, indptr, ids, similarities, item_ids=None):
+        self.names = names
+        self.item_ids = name_ids(names) if item_ids is None else item_ids
+        self.indptr = indptr
+        self.ids = ids
+        self.similarities = similarities
+    
+    @classmethod
+    def from_rows(cls, names, rows, item_ids=None):
+        item_ids = name_ids(names) if item_ids is None else item_ids
+        lengths, ids, similarities = [0], array('l'), array('d')
+        for item in names:
+            row = rows.get(item, ())
+            lengths.append(len(row))
+            for similarity, other in row:
+                ids.append(item_ids[other])
+                similarities.append(similarity)
+        
+        return cls(names, cumsum(lengths), asarray(ids, 'int32'), asarray(similarities, 'float64'), item_ids)
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __iter__(self):
+        return iter(self.names)
+    
+    def __contains__(self, item):
+        return item in self.item_ids
+    
+    def __getitem__(self, item):
+        i = self.item_ids[item]
+        start, end = self.indptr[i], self.indptr[i+1]
+        return SparseNeighbors(self.names, self.ids[start:end], self.similarities[start:end])
+    
+    def get(self, item, default=None):
+        return self[item] if item in self.item_ids else default
+    
+    def keys(self):
+        return list(self.names)
+    
+    def items(self):
+        return [(item, self[item]) for item in self.names]
@@ -0,0 +1,240 @@
+# Versioned binary files of named numpy arrays, that can be memory-mapped:
+#
+#     magic (8 bytes) | version (uint32) | header size (uint64) | header | arrays
+#
+# The header is a JSON object with the metadata and, for every array, its
+# dtype, shape and offset from the start of the (aligned) data section. It is
+# not a pickle: reading a file never runs code. The metadata can be None,
+# bools, numbers, strings, unicode, lists, tuples and dicts of them (see
+# encode), anything else has to be turned into those by the caller. Large
+# tables of names are arrays too (see NameTable), not metadata.
+import json
+import os
+import struct
+from base64 import b64decode, b64encode
+from zlib import crc32
+from numpy import argsort, ascontiguousarray, asarray, cumsum, dtype, fromfile, frombuffer, memmap, uint32, zeros
+
+ALIGNMENT = 64
+PREFIX = struct.Struct('<8sIQ')
+
+
+def aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def encode(value):
+    """
+    JSON value of the metadata: str (utf-8) is a JSON string, the other types
+    that JSON does not tell apart are tagged, e.g. {"t": [...]} for tuples.
+    """
+    if isinstance(value, str):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return {'b': b64encode(value)}
+    if isinstance(value, unicode):
+        return {'u': value}
+    if isinstance(value, tuple):
+        return {'t': map(encode, value)}
+    if isinstance(value, list):
+        return map(encode, value)
+    if isinstance(value, dict):
+        return {'d': [[encode(k), encode(v)] for k, v in value.items()]}
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    raise Exception("Unable to store a %s in a header" % type(value).__name__)
+
+
+def decode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return map(decode, value)
+    if isinstance(value, dict):
+        (tag, content), = value.items()
+        if tag == 'b': return b64decode(content)
+        if tag == 'u': return content
+        if tag == 't': return tuple(map(decode, content))
+        if tag == 'd': return dict((decode(k), decode(v)) for k, v in content)
+        raise Exception("Unknown header value: %s" % tag)
+    return value
+
+
+def write_arrays(path, magic, version, meta, arrays):
+    """
+    The file is written aside and then renamed to path: the processes that
+    have mapped the previous file keep reading it, the arrays can even be
+    the ones mapped from path.
+    """
+    arrays = [(name, ascontiguousarray(values)) for name, values in sorted(arrays.items())]
+    
+    layout, offset = {}, 0
+    for name, values in arrays:
+        layout[name] = (values.dtype.str, values.shape, offset)
+        offset = aligned(offset + values.nbytes)
+    
+    header = json.dumps({'meta': encode(meta), 'arrays': layout}, separators=(',', ':'))
+    start = aligned(PREFIX.size + len(header))
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(PREFIX.pack(magic, version, len(header)))
+            f.write(header)
+            for name, values in arrays:
+                f.seek(start + layout[name][2])
+                values.tofile(f)
+            f.truncate(start + offset)
+        os.rename(temporary, path)
+    finally:
+        if os.path.exists(temporary): os.remove(temporary)
+
+
+def read_arrays(path, magic, mmap=True):
+    """
+    Return (version, meta, arrays), with mmap the arrays are read-only views
+    of the file pages, shared among the processes that load the same file.
+    """
+    with open(path, 'rb') as f:
+        file_magic, version, header_size = PREFIX.unpack(f.read(PREFIX.size))
+        if file_magic != magic:
+            raise Exception("%s is not a %r file" % (path, magic.rstrip('\0')))
+        header = f.read(header_size)
+        if not header.startswith('{'):
+            raise Exception("%s has an unsupported header, it has to be saved again" % path)
+        header = json.loads(header)
+        start = aligned(PREFIX.size + header_size)
+        
+        arrays = {}
+        for name, (dtype_str, shape, offset) in header['arrays'].items():
+            name, dt, shape = str(name), dtype(str(dtype_str)), tuple(shape)
+            count = 1
+            for size in shape: count *= size
+            if count == 0:
+                arrays[name] = zeros(shape, dt)
+            elif mmap:
+                arrays[name] = memmap(path, dt, 'r', start + offset, shape)
+            else:
+                f.seek(start + offset)
+                arrays[name] = fromfile(f, dt, count).reshape(shape)
+    
+    return version, decode(header['meta']), arrays
+
+
+class NameTable:
+    """
+    Read-only list of names stored in arrays, so that it can be written with
+    write_arrays and memory-mapped back without building anything:
+        
+        blob[offsets[i]:offsets[i+1]]  bytes of the name with id i
+        hashes                         CRC-32 of the bytes of the names, sorted
+        order                          ids of the names, in the order of hashes
+    
+    names[i] is the name with id i, names.ids[name] its id, found with a
+    binary search of its hash. With kind 'str' the names are str, with kind
+    'json' any value of a header (see encode), stored as its JSON text.
+    """
+    def __init__(self, kind, offsets, blob, hashes, order):
+        self.kind = kind
+        self.offsets = offsets
+        self.blob = blob
+        self.hashes = hashes
+        self.order = order
+        self.data = buffer(blob)
+        self.ids = NameIds(self)
+    
+    @classmethod
+    def from_names(cls, names):
+        kind = 'str' if all([isinstance(name, str) for name in names]) else 'json'
+        data = [name_bytes(kind, name) for name in names]
+        offsets = zeros(len(data) + 1, dtype='int64')
+        cumsum([len(d) for d in data], out=offsets[1:])
+        blob = ''.join(data)
+        blob = frombuffer(blob, dtype='uint8') if blob else zeros(0, dtype='uint8')
+        hashes = asarray([crc32(d) & 0xffffffff for d in data], dtype='uint32')
+        order = argsort(hashes, kind='mergesort')
+        return cls(kind, offsets, blob, hashes[order], order.astype('int64'))
+    
+    def arrays(self, prefix):
+        """
+        The arrays of the table, named prefix_*, for write_arrays.
+        """
+        return {prefix + '_offsets': self.offsets, prefix + '_blob': self.blob,
+                prefix + '_hashes': self.hashes, prefix + '_order': self.order}
+    
+    @classmethod
+    def from_arrays(cls, kind, arrays, prefix):
+        return cls(kind, arrays[prefix + '_offsets'], arrays[prefix + '_blob'],
+                   arrays[prefix + '_hashes'], arrays[prefix + '_order'])
+    
+    def decode(self, data):
+        return data if self.kind == 'str' else decode(json.loads(data))
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, i):
+        offsets = self.offsets
+        return self.decode(self.data[offsets.item(i):offsets.item(i + 1)])
+    
+    def __iter__(self):
+        offsets = self.offsets.tolist()
+        return (self.decode(self.data[start:end]) for start, end in zip(offsets[:-1], offsets[1:]))
+    
+    def index(self, name, default=None):
+        data = name_bytes(self.kind, name)
+        if data is None: return default
+        key = crc32(data) & 0xffffffff
+        hashes, offsets = self.hashes, self.offsets
+        position = int(hashes.searchsorted(uint32(key)))
+        while position < len(hashes) and hashes.item(position) == key:
+            i = self.order.item(position)
+            if self.data[offsets.item(i):offsets.item(i + 1)] == data:
+                return i
+            position += 1
+        return default
+
+
+def name_bytes(kind, name):
+    """
+    Bytes of a name in a NameTable of that kind, None if it cannot be there.
+    """
+    if kind == 'str':
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return name if isinstance(name, str) else None
+    return json.dumps(encode(name), separators=(',', ':'))
+
+
+class NameIds:
+    """
+    Read-only {name: id} mapping of a NameTable.
+    """
+    def __init__(self, table):
+        self.table = table
+    
+    def __len__(self):
+        return len(self.table)
+    
+    def __iter__(self):
+        return iter(self.table)
+    
+    def __contains__(self, name):
+        return self.table.index(name) is not None
+    
+    def __getitem__(self, name):
+        i = self.table.index(name)
+        if i is None: raise KeyError(name)
+        return i
+    
+    def get(self, name, default=None):
+        return self.table.index(name, default)
+
+
+def name_ids(names):
+    """
+    {name: id} of a list of names, or of a NameTable (without building it).
+    """
+    if isinstance(names, NameTable):
+        return names.ids
+    return dict((name, i) for i, name in enumerate(names))
@@ -0,0 +1,53 @@
+# One-sided vs bidirectional searches between random pairs of nodes of a
+# weighted grid, and of a random graph with the same number of nodes and edges
+# (as CompiledGraphs):
+#    python benchmarks/bench_graphs.py [side of the grid] [queries]
+import sys
+import time
+from random import Random
+
+from numpy import arange
+from numpy.random import RandomState
+
+from algorithms.graphs import breadth_first_search, uniform_cost_search, bidirectional_bfs, bidirectional_dijkstra
+from algorithms.graphs.compiled import CompiledGraph
+
+
+def grid_graph(side, seed=0):
+    nodes = arange(side * side).reshape(side, side)
+    firsts = list(nodes[:, :-1].ravel()) + list(nodes[:-1, :].ravel())
+    seconds = list(nodes[:, 1:].ravel()) + list(nodes[1:, :].ravel())
+    weights = RandomState(seed).randint(1, 10, size=len(firsts))
+    return CompiledGraph.from_edges(firsts, seconds, weights, num_nodes=side * side)
+
+
+def random_graph(num_nodes, num_edges, seed=0):
+    random = RandomState(seed)
+    firsts, seconds = random.randint(num_nodes, size=num_edges), random.randint(num_nodes, size=num_edges)
+    return CompiledGraph.from_edges(firsts, seconds, random.randint(1, 10, size=num_edges), num_nodes=num_nodes)
+
+
+def timed(search, graph, queries):
+    start = time.time()
+    iterations = 0
+    for a, b in queries:
+        path = search(graph, a, b)
+        iterations += path.iterations if path is not None else 0
+    return time.time() - start, iterations
+
+
+if __name__ == '__main__':
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    grid = grid_graph(side)
+    random = Random(0)
+    queries = [(random.randrange(len(grid)), random.randrange(len(grid))) for _ in range(num_queries)]
+    
+    for name, graph in (("grid", grid), ("random", random_graph(len(grid), len(grid.targets) // 2))):
+        print "%s graph, %d nodes, %d queries" % (name, len(graph), num_queries)
+        for one_sided, bidirectional in ((breadth_first_search, bidirectional_bfs),
+                                         (uniform_cost_search, bidirectional_dijkstra)):
+            elapsed, iterations = timed(one_sided, graph, queries)
+            bi_elapsed, bi_iterations = timed(bidirectional, graph, queries)
+            print "    %s: %.2fs, %d expanded nodes" % (one_sided.__name__, elapsed, iterations)
+            print "    %s: %.2fs, %d expanded nodes (%.1fx faster)" % (bidirectional.__name__, bi_elapsed, bi_iterations, elapsed / bi_elapsed)
@@ -0,0 +1,35 @@
+# Serial vs map-reduce training of the naive Bayes model, on a synthetic corpus:
+#    python benchmarks/bench_naive_bayes.py [items per class] [max workers]
+import sys
+import time
+from random import Random
+from multiprocessing import cpu_count
+
+from algorithms.classifiers.naive_bayes import Model
+
+
+def synthetic_corpus(classes=4, items=25000, words=30, vocabulary=50000, seed=0):
+    random = Random(seed)
+    return [("class %d" % c, [["w%d" % random.randint(0, vocabulary) for _ in range(words)]
+                              for _ in range(items)])
+            for c in range(classes)]
+
+
+def timed(train):
+    start = time.time()
+    train()
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 25000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else cpu_count()
+    data = synthetic_corpus(items=items)
+    
+    serial = timed(lambda: Model(data))
+    print "serial: %.2fs" % serial
+    workers = 1
+    while workers <= max_workers:
+        elapsed = timed(lambda: Model.train_parallel(data, workers=workers))
+        print "%d workers: %.2fs (speedup %.2fx)" % (workers, elapsed, serial / elapsed)
+        workers *= 2
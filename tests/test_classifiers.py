@@ -1,11 +1,20 @@
 # Examples taken from the course "Introduction to Artificial Intelligence", Sebastian Thrun and Peter Norvig:
 #    https://www.ai-class.com
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+from zlib import crc32
 from nose.tools import assert_almost_equal
 def verify(value, expected):
     assert_almost_equal(value, expected, places=4)
 
 
+import algorithms
 from algorithms.classifiers.naive_bayes import Model, Classifier
+from algorithms.classifiers.hashing import bucket
+from algorithms.storage import read_arrays, write_arrays
 
 SPAM_DATA = (
     ("spam", (
@@ -83,6 +92,207 @@ def test_NaiveBayesClassifier_without_smoothing_2():
 
 
 
+def test_NaiveBayesClassifier_batch():
+    for data in (SPAM_DATA, TITLE_DATA):
+        for k in (0, 1):
+            classifier = Classifier(Model(simple_tokenizer(data), k=k))
+            items = [item.split() for _, items in data for item in items]
+            items += [["sports"], ["perfect", "storm"], ["unknown", "words"], ["today", "is", "secret"]]
+            
+            batch_probs = classifier.get_normalised_probabilities_batch(items)
+            for item, label, probs in zip(items, classifier.classify_batch(items), batch_probs):
+                if sum([c.prob for c in classifier.get_probabilities(item)]) == 0: continue
+                expected = classifier.get_normalised_probabilities(item)
+                for name in expected:
+                    verify(probs[name], expected[name])
+                assert probs[label] == max(probs.values())
+                if len(set(expected.values())) > 1:
+                    assert label == classifier.classify(item)
+    
+    # long items underflow to 0 when the probabilities are multiplied
+    classifier = Classifier(Model(simple_tokenizer(SPAM_DATA), k=1))
+    item = ["secret", "sports", "link"] * 300
+    assert all([c.prob == 0.0 for c in classifier.get_probabilities(item)])
+    assert classifier.classify_batch([item]) == ["spam"]
+    verify(sum(classifier.get_normalised_probabilities_batch([item])[0].values()), 1.0)
+
+
+def verify_same_model(model, expected_model):
+    assert model.features_num == expected_model.features_num
+    assert sorted(model.classes.keys()) == sorted(expected_model.classes.keys())
+    for name, expected_class in expected_model.classes.items():
+        model_class = model.classes[name]
+        verify(model_class.prior, expected_class.prior)
+        verify(model_class.base_prob, expected_class.base_prob)
+        assert sorted(model_class.feature_prob.keys()) == sorted(expected_class.feature_prob.keys())
+        for feature, prob in expected_class.feature_prob.items():
+            verify(model_class.P(feature), prob)
+
+
+def test_NaiveBayesClassifier_partial_fit():
+    for k in (0, 1):
+        data = simple_tokenizer(SPAM_DATA + TITLE_DATA)
+        model = Model(data[:1], k=k)
+        spam = model.classes["spam"]
+        for class_data in data[1:]:
+            model.partial_fit([class_data])
+        verify_same_model(model, Model(data, k=k))
+        assert model.classes["spam"] is spam
+        
+        # more items of an existing class, with known and new features
+        more = simple_tokenizer((("ham", ("sports today", "rainy sports day")),))
+        model.partial_fit(more)
+        verify_same_model(model, Model(data + more, k=k))
+    
+    classifier = Classifier()
+    classifier.partial_fit(simple_tokenizer(SPAM_DATA[:1]))
+    assert classifier.classify_batch([["sports"]]) == ["spam"]
+    classifier.partial_fit(simple_tokenizer(SPAM_DATA[1:]))
+    assert classifier.classify_batch([["sports"]]) == ["ham"]
+    expected = Classifier(Model(simple_tokenizer(SPAM_DATA)))
+    verify(classifier.get_normalised_probabilities(["sports"])["spam"],
+           expected.get_normalised_probabilities(["sports"])["spam"])
+
+
+def test_NaiveBayesClassifier_parallel_training():
+    data = simple_tokenizer(SPAM_DATA + TITLE_DATA)
+    for k in (0, 1):
+        for workers, shard_size in ((1, 1), (2, 2), (3, 100)):
+            verify_same_model(Model.train_parallel(data, k, workers, shard_size), Model(data, k=k))
+    
+    classifier = Classifier()
+    classifier.train(simple_tokenizer(SPAM_DATA), workers=2)
+    verify(classifier.get_normalised_probabilities(["today", "is", "secret"])["spam"], 0.4858)
+
+
+def test_NaiveBayesClassifier_hashing():
+    data = simple_tokenizer(SPAM_DATA + TITLE_DATA)
+    features = set([f for _, items in data for item in items for f in item])
+    buckets = 2 ** 20
+    assert len(set([bucket(f, buckets) for f in features])) == len(features) # no collisions
+    assert bucket("secret", buckets) == bucket(u"secret", buckets) == (crc32("secret") & 0xffffffff) % buckets
+    for k in (0, 1):
+        exact = Classifier(Model(data, k=k))
+        hashed = Classifier(Model(data, k=k, buckets=buckets))
+        assert hashed.model.features_num == exact.model.features_num
+        for name, expected_class in exact.model.classes.items():
+            hashed_class = hashed.model.classes[name]
+            verify(hashed_class.prior, expected_class.prior)
+            verify(hashed_class.P("unknown"), expected_class.base_prob)
+            for feature in features:
+                verify(hashed_class.P(feature), expected_class.P(feature))
+        
+        items = [["sports"], ["perfect", "storm"], ["today", "is", "secret"]]
+        assert hashed.classify_batch(items) == exact.classify_batch(items)
+        for probs, expected in zip(hashed.get_normalised_probabilities_batch(items), exact.get_normalised_probabilities_batch(items)):
+            for name in expected:
+                verify(probs[name], expected[name])
+        
+        # incremental and parallel training count the same buckets
+        model = Model(data[:1], k=k, buckets=64)
+        for class_data in data[1:]:
+            model.partial_fit([class_data])
+        expected_model = Model(data, k=k, buckets=64)
+        for other in (model, Model.train_parallel(data, k, 2, 2, buckets=64)):
+            assert other.features_num == expected_model.features_num
+            for name, expected_class in expected_model.classes.items():
+                verify(other.classes[name].prior, expected_class.prior)
+                assert abs(other.classes[name].feature_prob - expected_class.feature_prob).max() < 1e-12
+    
+    # with a single bucket all the features collide: they are one feature
+    model = Model(data, k=1, buckets=1)
+    assert model.features_num == 1
+    for model_class in model.classes.values():
+        verify(model_class.P("secret"), model_class.P("unknown"))
+
+
+def test_NaiveBayesClassifier_save_and_load():
+    data = simple_tokenizer(SPAM_DATA + TITLE_DATA)
+    items = [item for _, class_items in data for item in class_items]
+    items += [["sports"], ["unknown", "words"], ["today", "is", "secret"]]
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for k, buckets in ((0, None), (1, None), (1, 64)):
+            model = Model(data, k=k, buckets=buckets)
+            expected = Classifier(model)
+            for dtype in ('float64', 'float32'):
+                model.save(path, dtype)
+                for mmap in (True, False):
+                    classifier = Classifier(Model.load(path, mmap))
+                    assert classifier.model.features_num == model.features_num
+                    assert classifier.classify_batch(items) == expected.classify_batch(items)
+                    for item in items:
+                        probs = classifier.get_normalised_probabilities_batch([item])[0]
+                        for name, prob in expected.get_normalised_probabilities_batch([item])[0].items():
+                            verify(probs[name], prob)
+                        if sum([c.prob for c in expected.get_probabilities(item)]) == 0: continue
+                        probs = classifier.get_normalised_probabilities(item)
+                        for name, prob in expected.get_normalised_probabilities(item).items():
+                            verify(probs[name], prob)
+                    
+                    try:
+                        classifier.partial_fit(data)
+                        assert False
+                    except Exception as e:
+                        assert "loaded model" in str(e)
+        
+        # a loaded model keeps its vocabulary mapped, and can be saved again
+        Model(data, k=1).save(path)
+        loaded = Model.load(path)
+        assert loaded.compile().vocabulary.get("secret") is not None
+        assert loaded.compile().vocabulary.get("unknown") is None
+        expected = Classifier(loaded).get_normalised_probabilities_batch(items)
+        loaded.save(path + '.copy')
+        for probs, expected_probs in zip(Classifier(Model.load(path + '.copy')).get_normalised_probabilities_batch(items), expected):
+            for name, prob in expected_probs.items():
+                verify(probs[name], prob)
+        
+        # hashed features fall in the same buckets in another process
+        model = Model(data, k=1, buckets=64)
+        model.save(path)
+        script = ("from algorithms.classifiers.naive_bayes import Model, Classifier\n"
+                  "print Classifier(Model.load(%r)).get_normalised_probabilities_batch([['today', 'is', 'secret']])" % path)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(algorithms.__file__)))
+        env = dict(os.environ, PYTHONHASHSEED='123', PYTHONPATH=root)
+        output = subprocess.check_output([sys.executable, '-c', script], env=env)
+        probs = eval(output)[0]
+        for name, prob in Classifier(model).get_normalised_probabilities_batch([['today', 'is', 'secret']])[0].items():
+            verify(probs[name], prob)
+        
+        # files whose buckets cannot be reproduced are rejected
+        version, meta, arrays = read_arrays(path, Model.SNAPSHOT_MAGIC, False)
+        meta['hash_function'] = 'hash'
+        write_arrays(path, Model.SNAPSHOT_MAGIC, version, meta, arrays)
+        try:
+            Model.load(path)
+            assert False
+        except Exception as e:
+            assert "hash function" in str(e)
+    finally:
+        for file_path in (path, path + '.copy'):
+            if os.path.exists(file_path): os.remove(file_path)
+
+
+def test_NaiveBayesClassifier_classify_stream():
+    classifier = Classifier(Model(simple_tokenizer(SPAM_DATA), k=1))
+    records = ["offer is secret", "play sports today", "perfect storm", "today is secret", ""]
+    items = [record.split() for record in records]
+    expected = zip(classifier.classify_batch(items), classifier.get_normalised_probabilities_batch(items))
+    for batch_size in (1, 2, 100):
+        reports = []
+        results = list(classifier.classify_stream(records, batch_size, str.split, reports.append))
+        assert [label for label, _ in results] == [label for label, _ in expected]
+        for (_, probs), (_, expected_probs) in zip(results, expected):
+            for name in expected_probs:
+                verify(probs[name], expected_probs[name])
+        assert reports[-1] == len(records)
+        assert len(reports) == (len(records) + batch_size - 1) // batch_size
+    
+    # the stream is consumed lazily
+    stream = classifier.classify_stream(itertools.cycle(items), batch_size=2)
+    assert [label for label, _ in itertools.islice(stream, 3)] == [label for label, _ in expected[:3]]
+
 
 if __name__ == '__main__':
     test_NaiveBayesClassifier_without_smoothing()
@@ -90,3 +300,10 @@ if __name__ == '__main__':
     
     test_NaiveBayesClassifier_with_smoothing_2()
     test_NaiveBayesClassifier_without_smoothing_2()
+    
+    test_NaiveBayesClassifier_batch()
+    test_NaiveBayesClassifier_partial_fit()
+    test_NaiveBayesClassifier_parallel_training()
+    test_NaiveBayesClassifier_hashing()
+    test_NaiveBayesClassifier_save_and_load()
+    test_NaiveBayesClassifier_classify_stream()
@@ -1,4 +1,14 @@
-from algorithms.clusters.hierarchical import Item, find_clusters
+import os
+import tempfile
+from numpy import array, dtype, memmap, sqrt
+from numpy.linalg import norm
+from numpy.random import RandomState
+
+from algorithms.clusters.hierarchical import Item, cut_by_count, cut_by_distance, find_clusters
+from algorithms.clusters.distances import as_values, pairwise_distances
+from algorithms.clusters.kmeans import MiniBatchKMeans
+from algorithms.clusters.linkage import cluster_labels, linkage, merges_for_count
+from algorithms.clusters.spatial import GroupIndex, KDTree, single_linkage
 
 
 def test_3D_hierarchical_clusters():
@@ -83,8 +93,177 @@ def test_langpop_hierarchical_clusters():
         assert [item.name for item in cluster.items] == expected_list
 
 
+def groups_distance(a, b, method):
+    # Definitions of the linkage methods, on the items of the two groups
+    distances = [norm(x - y) for x in a for y in b]
+    if method == 'single':
+        return min(distances)
+    if method == 'complete':
+        return max(distances)
+    if method == 'average':
+        return sum(distances) / len(distances)
+    
+    distance = norm(a.mean(axis=0) - b.mean(axis=0))
+    if method == 'centroid':
+        return distance
+    return sqrt(2.0 * len(a) * len(b) / (len(a) + len(b))) * distance # ward
+
+
+def test_linkage_methods():
+    random = RandomState(0)
+    for n, d in ((2, 1), (12, 2), (30, 3)):
+        values = random.randn(n, d)
+        for method in ('single', 'complete', 'average', 'ward', 'centroid'):
+            clusters = dict((i, array([v])) for i, v in enumerate(values))
+            tree = linkage(values, method)
+            assert tree.shape == (n - 1, 4)
+            for i, (a, b, distance, size) in enumerate(tree):
+                a, b = int(a), int(b)
+                # every merge is of the closest pair of clusters
+                expected = min([groups_distance(clusters[x], clusters[y], method)
+                                for x in clusters for y in clusters if x < y])
+                assert abs(distance - expected) < 1e-9, (method, i)
+                assert abs(groups_distance(clusters[a], clusters[b], method) - expected) < 1e-9
+                clusters[n + i] = array(list(clusters.pop(a)) + list(clusters.pop(b)))
+                assert size == len(clusters[n + i])
+    
+    assert linkage([[1.0, 2.0]]).shape == (0, 4)
+    assert find_clusters([], ('c1', 'c2')) == []
+
+
+def test_linkage_cuts():
+    items = [Item(lang, n) for lang, n in LANGUAGES_POPULARITY]
+    tree = linkage([item.values for item in items])
+    
+    # the tree is cut at any number of clusters without clustering again
+    expected = find_clusters(items, ('Ubiquitous', 'Very Popular', 'Popular', 'Niche'))
+    assert [sorted(c.items) for c in cut_by_count(items, tree, 4)] == [sorted(c.items) for c in expected]
+    for k in range(1, len(items) + 2):
+        clusters = cut_by_count(items, tree, k)
+        assert len(clusters) == min(k, len(items))
+        assert sorted(sum([c.items for c in clusters], [])) == sorted(items)
+        
+        # the same clusters are found cutting between two merge distances
+        if 1 < k < len(items):
+            distance = (tree[-k, 2] + tree[-k + 1, 2]) / 2
+            by_distance = cut_by_distance(items, tree, distance)
+            assert [sorted(c.items) for c in by_distance] == [sorted(c.items) for c in clusters]
+    
+    assert len(cut_by_distance(items, tree, 0.0)) == len(items)
+    assert len(cut_by_distance(items, tree, tree[-1, 2])) == 1
+
+
+def test_pairwise_distances():
+    values = RandomState(1).randn(40, 5)
+    expected = [norm(values[i] - values[j]) for i in range(40) for j in range(i + 1, 40)]
+    for block_size in (1, 100, 2 ** 22):
+        distances = pairwise_distances(values, block_size=block_size)
+        assert abs(distances - expected).max() < 1e-9
+        assert abs(pairwise_distances(values, True, block_size=block_size) - array(expected) ** 2).max() < 1e-9
+    
+    distances = pairwise_distances(values, dtype='float32')
+    assert distances.dtype == dtype('float32')
+    assert abs(distances - expected).max() < 1e-4
+    
+    # larger than the memory limit: spilled to a memory-mapped file
+    distances = pairwise_distances(values, memory_limit=0)
+    assert isinstance(distances, memmap)
+    assert abs(distances - expected).max() < 1e-9
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        pairwise_distances(values, path=path)
+        assert abs(memmap(path, 'float64', 'r') - expected).max() < 1e-9
+    finally:
+        os.remove(path)
+    
+    # the same clusters from an array of values, in a memory-mapped file
+    items = [Item(lang, n) for lang, n in LANGUAGES_POPULARITY]
+    expected = find_clusters(items, ('Ubiquitous', 'Very Popular', 'Popular', 'Niche'))
+    for clusters in (find_clusters(as_values(items), range(4), memory_limit=0),
+                     find_clusters(as_values(items), range(4), dtype='float32')):
+        assert [[items[i.name].name for i in c.items] for c in clusters] == [[i.name for i in c.items] for c in expected]
+
+
+def test_minibatch_kmeans():
+    random = RandomState(2)
+    centers = array([[0, 0, 0], [10, 10, 10], [-10, 10, 0]])
+    items = [Item('c%d_%d' % (c, i), centers[c] + random.randn(3)) for i in range(100) for c in range(3)]
+    expected = sorted([sorted(i.name for i in c.items) for c in find_clusters(items, range(3))])
+    for init in ('k-means++', 'hierarchical'):
+        # a stream of Items, or of chunks of values
+        for stream in (iter(items), (as_values(items[i:i + 7]) for i in range(0, len(items), 7))):
+            kmeans = MiniBatchKMeans(3, batch_size=20, init=init, seed=0).fit(stream)
+            assert kmeans.counts.sum() == len(items)
+            
+            clusters = kmeans.groups(items, ('a', 'b', 'c'))
+            assert sorted([sorted(i.name for i in c.items) for c in clusters]) == expected
+            assert [c.name for c in clusters] == ['a', 'b', 'c']
+            for c in clusters:
+                # the centers are the means of the values assigned while streaming
+                assert norm(c.values - as_values(c.items).mean(axis=0)) < 1.0
+    
+    kmeans = MiniBatchKMeans(3, seed=0)
+    kmeans.partial_fit(as_values(items))
+    assert sorted(kmeans.counts) == [100, 100, 100]
+    assert all([len(c.items) == 0 for c in kmeans.groups()])
+    try:
+        MiniBatchKMeans(3).fit(items[:2])
+        assert False
+    except Exception as e:
+        assert "At least 3 values" in str(e)
+
+
+def test_kdtree():
+    random = RandomState(3)
+    values = random.randn(500, 3)
+    tree = KDTree(values, leaf_size=8)
+    for point in random.randn(20, 3):
+        expected = sqrt(((values - point) ** 2).sum(axis=1))
+        distances, indexes = tree.query(point, 5)
+        assert list(indexes) == list(expected.argsort()[:5])
+        assert abs(distances - expected[indexes]).max() < 1e-9
+        
+        distances, indexes = tree.query_radius(point, 1.0)
+        assert sorted(indexes) == sorted((expected <= 1.0).nonzero()[0])
+        assert list(distances) == sorted(distances)
+    
+    # new items are assigned to the group with the nearest centroid, or item
+    clusters = find_clusters([Item(lang, n) for lang, n in LANGUAGES_POPULARITY], range(4))
+    items = [Item('new', n) for n in (120.0, 75.0, 60.0, 40.0, 20.0, -1.0)]
+    for members in (False, True):
+        predicted = GroupIndex(clusters, members).predict(items)
+        for item, group in zip(items, predicted):
+            if members:
+                distances = [min([item.distance(i) for i in c.items]) for c in clusters]
+            else:
+                distances = [item.distance(c) for c in clusters]
+            assert group is clusters[distances.index(min(distances))]
+    
+    # single linkage from the minimum spanning tree, without the pairwise distances
+    for n in (0, 1, 2, 300):
+        values = random.randn(n, 2)
+        tree, expected = single_linkage(values, leaf_size=4), linkage(values, 'single')
+        assert tree.shape == expected.shape
+        if n > 1: assert abs(tree[:, 2:] - expected[:, 2:]).max() < 1e-9
+        for k in (2, 5):
+            assert sorted(map(sorted, cluster_members(tree, k))) == sorted(map(sorted, cluster_members(expected, k)))
+
+
+def cluster_members(tree, k):
+    groups = {}
+    for i, label in enumerate(cluster_labels(tree, merges_for_count(tree, k))):
+        groups.setdefault(label, []).append(i)
+    return groups.values()
+
+
 if __name__ == '__main__':
     test_3D_hierarchical_clusters()
     test_langpop_hierarchical_clusters()
+    test_linkage_methods()
+    test_linkage_cuts()
+    test_pairwise_distances()
+    test_minibatch_kmeans()
+    test_kdtree()
 
 
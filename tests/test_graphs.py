@@ -1,6 +1,13 @@
 # Examples taken from the course "Introduction to Artificial Intelligence", Sebastian Thrun and Peter Norvig:
 #    https://www.ai-class.com
+import os
+import tempfile
+from random import Random
 from algorithms.graphs import Graph, breadth_first_search, depth_first_search, uniform_cost_search, a_star_search
+from algorithms.graphs import bidirectional_bfs, bidirectional_dijkstra
+from algorithms.graphs.compiled import CompiledGraph
+from algorithms.graphs.frontier import PriorityFrontier
+from algorithms.graphs.readers import load_graph
 
 ROMANIA_GRAPH = Graph([
     ("Arad", "Sibiu", 140),
@@ -74,9 +81,165 @@ def test_a_star_search():
     assert path.iterations == 6
     print path
 
+def test_uniform_cost_search_better_path():
+    # the path to C through B is found when C is already in the frontier
+    graph = Graph([("A", "B", 1), ("A", "C", 5), ("B", "C", 1), ("C", "D", 1), ("D", "E", 10)])
+    path = uniform_cost_search(graph, "A", "E")
+    assert path.nodes == ["A", "B", "C", "D", "E"]
+    assert path.cost == 13
+    assert path.iterations == 5
+    
+    graph.add_node("F")
+    for search in (breadth_first_search, depth_first_search, uniform_cost_search):
+        assert search(graph, "A", "F") is None
+
+
+def test_priority_frontier():
+    frontier = PriorityFrontier()
+    for node, priority in (("a", 3), ("b", 1), ("c", 3), ("d", 2)):
+        frontier.push(node, priority)
+    frontier.push("a", 2) # better priority: the old entry is stale
+    assert len(frontier) == 4
+    
+    # on ties the nodes come out in order of insertion
+    assert [frontier.pop() for _ in range(4)] == ["b", "d", "a", "c"]
+    assert len(frontier) == 0
+    
+    # the heap does not grow with the updates of the same nodes
+    for priority in range(1000, 0, -1):
+        for node in range(10):
+            frontier.push(node, priority)
+    assert len(frontier.heap) <= 2 * len(frontier) + 16
+    assert [frontier.pop() for _ in range(10)] == range(10)
+
+
+def test_compiled_graph():
+    graph = ROMANIA_GRAPH.compile()
+    assert sorted(graph.nodes()) == sorted(ROMANIA_GRAPH.nodes())
+    for node in ROMANIA_GRAPH.nodes():
+        assert graph.edges(node) == ROMANIA_GRAPH.edges(node)
+    
+    # the searchers run unchanged, with the same results
+    for search in (breadth_first_search, depth_first_search, uniform_cost_search):
+        path, expected = search(graph, "Arad", "Bucharest"), search(ROMANIA_GRAPH, "Arad", "Bucharest")
+        assert (path.nodes, path.cost, path.iterations) == (expected.nodes, expected.cost, expected.iterations)
+    path = a_star_search(graph, "Arad", "Bucharest", distance_heuristic)
+    assert (path.nodes, path.cost, path.iterations) == (["Arad", "Sibiu", "Rimnicu Vilcea", "Pitesti", "Bucharest"], 418, 6)
+    
+    # from arrays of ids: undirected, the last cost of repeated edges is kept
+    graph = CompiledGraph.from_edges([0, 1, 2, 0, 3], [1, 2, 0, 1, 3], [5, 1, 1, 2, 7], num_nodes=5)
+    assert graph.nodes() == [0, 1, 2, 3, 4]
+    assert graph.edges(0) == [(1, 2), (2, 1)]
+    assert graph.edges(1) == [(0, 2), (2, 1)]
+    assert graph.edges(3) == [(3, 7)]
+    assert graph.edges(4) == []
+    assert uniform_cost_search(graph, 0, 1).cost == 2
+    graph = CompiledGraph.from_edges([0, 1, 1], [1, 0, 1], [5, 2, 3])
+    assert (graph.edges(0), graph.edges(1)) == ([(1, 2)], [(0, 2), (1, 3)])
+    
+    graph = CompiledGraph.from_edges([0, 1], [1, 2], names=["a", "b", "c"])
+    assert graph.edges("b") == [("a", 1), ("c", 1)]
+    assert breadth_first_search(graph, "a", "c").nodes == ["a", "b", "c"]
+
+
+ROMANIA_EDGES = """# first second cost
+Arad Sibiu 140
+Arad  Zerind 75
+Arad Timisoara 118
+Sibiu Fagaras 99
+Sibiu Rimnicu_Vilcea 80
+
+Rimnicu_Vilcea Craiova 146
+Rimnicu_Vilcea Pitesti 97
+Pitesti Bucharest 101
+Drobeta Craiova 120
+Zerind Oradea 71
+Oradea Sibiu 151
+Timisoara Lugoj 111
+Lugoj Mehadia 70
+Mehadia Drobeta 75
+Craiova Pitesti 138
+Fagaras Bucharest 211
+Bucharest Giurgiu 90
+Bucharest Urziceni 85
+"""
+
+def test_load_graph():
+    lines = ROMANIA_EDGES.splitlines(True)
+    csv_lines = ["first,second,cost\n"] + [", ".join(line.split()) + "\n" for line in lines[1:]]
+    for graph in (load_graph(lines), load_graph(csv_lines, ',', skip_header=True)):
+        assert len(graph) == len(ROMANIA_GRAPH.nodes())
+        path = uniform_cost_search(graph, "Arad", "Bucharest")
+        assert path.nodes == ["Arad", "Sibiu", "Rimnicu_Vilcea", "Pitesti", "Bucharest"]
+        assert (path.cost, path.iterations) == (418, 13)
+    
+    # saved, and memory-mapped back
+    fd, file_path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        graph.save(file_path)
+        for mmap in (True, False):
+            loaded = CompiledGraph.load(file_path, mmap)
+            assert loaded.nodes() == graph.nodes()
+            for node in graph.nodes():
+                assert loaded.edges(node) == graph.edges(node)
+            assert uniform_cost_search(loaded, "Arad", "Bucharest").cost == 418
+            assert "Paris" not in loaded.ids
+        
+        # nodes that are not strings
+        graph = CompiledGraph.from_edges([0, 1], [1, 2], [3, 4], names=[("a", 1), u"b", 3])
+        graph.save(file_path)
+        loaded = CompiledGraph.load(file_path)
+        assert loaded.nodes() == [("a", 1), u"b", 3]
+        assert loaded.edges(("a", 1)) == [(u"b", 3)] and loaded.edges(3) == [(u"b", 4)]
+    finally:
+        if os.path.exists(file_path): os.remove(file_path)
+    
+    # without costs, and with the ids of the nodes in the file
+    graph = load_graph(["0 1", "1 2", "2 0 5", "# comment", "3 1"], integer_ids=True)
+    assert graph.nodes() == [0, 1, 2, 3]
+    assert graph.edges(1) == [(0, 1), (2, 1), (3, 1)]
+    assert breadth_first_search(graph, 0, 3).nodes == [0, 1, 3]
+
+
+def test_bidirectional_search():
+    path = bidirectional_bfs(ROMANIA_GRAPH, "Arad", "Bucharest")
+    assert path.nodes == ["Arad", "Sibiu", "Fagaras", "Bucharest"]
+    assert path.cost == 450
+    assert path.iterations == 5
+    
+    path = bidirectional_dijkstra(ROMANIA_GRAPH, "Arad", "Bucharest")
+    assert path.nodes == ["Arad", "Sibiu", "Rimnicu Vilcea", "Pitesti", "Bucharest"]
+    assert path.cost == 418
+    assert path.iterations == 9
+    
+    # the same costs and lengths of the one-sided searches, on a random graph
+    random = Random(0)
+    graph = Graph([(random.randint(0, 60), random.randint(0, 60), random.randint(1, 20)) for _ in range(120)])
+    graph.add_node(61)
+    for start in range(0, 62, 3):
+        for end in range(0, 62, 5):
+            expected, path = uniform_cost_search(graph, start, end), bidirectional_dijkstra(graph, start, end)
+            if expected is None:
+                assert path is None and bidirectional_bfs(graph, start, end) is None
+                continue
+            
+            assert path.cost == expected.cost
+            assert path.nodes[0] == start and path.nodes[-1] == end
+            assert sum([dict(graph.edges(a))[b] for a, b in zip(path.nodes, path.nodes[1:])]) == path.cost
+            
+            path = bidirectional_bfs(graph, start, end)
+            assert path.length == breadth_first_search(graph, start, end).length
+            assert sum([dict(graph.edges(a))[b] for a, b in zip(path.nodes, path.nodes[1:])]) == path.cost
+
 
 if __name__ == "__main__":
     test_breadth_first_search()
     test_depth_first_search()
     test_uniform_cost_search()
     test_a_star_search()
+    test_uniform_cost_search_better_path()
+    test_priority_frontier()
+    test_compiled_graph()
+    test_load_graph()
+    test_bidirectional_search()
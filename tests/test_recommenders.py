@@ -1,10 +1,19 @@
 # Examples taken from "Programming Collective Intelligence", Toby Segaran:
 #    http://shop.oreilly.com/product/9780596529321.do
+import cPickle as pickle
+import itertools
+import os
+import tempfile
+from random import Random
 from nose.tools import assert_almost_equal
+from numpy import zeros
 def verify(value, expected):
     assert_almost_equal(value, expected, places=4)
 
-from algorithms.recommenders import PreferencesModel
+from algorithms.recommenders import PreferencesModel, similarity, batch_similarities
+from algorithms.recommenders.metrics import pearson_metric, euclidean_metric
+from algorithms.recommenders.lsh import recall_at_k
+from algorithms.storage import PREFIX, NameTable, read_arrays, write_arrays
 
 
 USERS_RATINGS = (
@@ -38,7 +47,306 @@ def verify_ranks(ranks, expected_ranks):
         verify(rank, expected_rank)
 
 
+def verify_same_results(model, expected_model):
+    for user in expected_model.users.keys():
+        verify_ranks(model.similar_users(user, None), expected_model.similar_users(user, None))
+        verify_ranks(model.user_based_recommendations(user, None),
+                     expected_model.user_based_recommendations(user, None))
+        verify_ranks(model.item_based_recommendations(user, None),
+                     expected_model.item_based_recommendations(user, None))
+    
+    for item in expected_model.items.keys():
+        verify_ranks(model.similar_items(item, None), expected_model.similar_items(item, None))
+        verify_ranks(model.user_recommendations(item, None), expected_model.user_recommendations(item, None))
+
+
+def test_sparse_preferences_model():
+    model = PreferencesModel(USERS_RATINGS, sparse=True)
+    
+    verify(model.users_similarity('Lisa Rose', 'Gene Seymour') , 0.3961)
+    verify(model.users['Toby']['Snakes on a Plane'], 4.5)
+    assert 'Lady in the Water' not in model.users['Toby']
+    assert sorted(model.items['Just My Luck'].keys()) == ['Claudia Puig', 'Gene Seymour', 'Lisa Rose', 'Mick LaSalle']
+    
+    verify_same_results(model, PreferencesModel(USERS_RATINGS))
+
+
+def test_batch_similarities():
+    data = {
+        'a': {'x': 1.0, 'y': 2.0, 'z': 4.0},
+        'b': {'x': 2.0, 'y': 3.5, 'z': 3.0},
+        'constant': {'x': 3.0, 'y': 3.0},   # den == 0
+        'single': {'z': 2.0},               # one co-rated feature
+        'disjoint': {'w': 5.0},             # no overlap
+    }
+    for metric in (pearson_metric, euclidean_metric):
+        similarities = batch_similarities(data, 'a', metric)
+        for b, s in zip(data.keys(), similarities):
+            verify(s, similarity(data, 'a', b, metric))
+    
+    # metrics without a kernel are computed pair by pair
+    pearson = lambda X, Y: pearson_metric(X, Y)
+    assert batch_similarities(data, 'a', pearson) is None
+    for sparse in (False, True):
+        expected = PreferencesModel(USERS_RATINGS, pearson, sparse=sparse)
+        verify_same_results(PreferencesModel(USERS_RATINGS, sparse=sparse), expected)
+    
+    # items whose similarities are all 0 have no weighted rating
+    ratings = (('A', (('x', 1.0), ('y', 2.0))), ('B', (('x', 3.0), ('z', 4.0))))
+    for sparse in (False, True):
+        assert PreferencesModel(ratings, sparse=sparse).item_based_recommendations('A') == []
+
+
+def verify_same_similars(model, expected_model):
+    assert sorted(model.item_similars.keys()) == sorted(expected_model.item_similars.keys())
+    for item, similars in expected_model.item_similars.items():
+        assert len(model.item_similars[item]) == len(similars)
+        verify_ranks(model.item_similars[item], similars)
+
+
+def test_incremental_item_similarities():
+    metrics = (pearson_metric, euclidean_metric, lambda X, Y: pearson_metric(X, Y))
+    for metric, incremental in itertools.product(metrics, (False, True)):
+        model = PreferencesModel(USERS_RATINGS[:3], metric, incremental=incremental)
+        assert (model.item_index.stats is not None) == (incremental and metric in metrics[:2])
+        for user, ratings in USERS_RATINGS[3:]:
+            for item, rating in ratings:
+                model.add_rating(user, item, rating)
+        verify_same_similars(model, PreferencesModel(USERS_RATINGS, metric))
+        
+        model.add_rating('Toby', 'Superman Returns', 1.5)
+        model.add_rating('Toby', 'Just My Luck', 4.0)
+        model.remove_rating('Gene Seymour', 'Lady in the Water')
+        model.add_rating('Newcomer', 'Snakes on a Plane', 2.0)
+        for item, rating in USERS_RATINGS[1][1]:
+            model.remove_rating('Gene Seymour', item)
+        
+        data = dict((user, dict(ratings)) for user, ratings in USERS_RATINGS[2:])
+        data['Toby'].update({'Superman Returns': 1.5, 'Just My Luck': 4.0})
+        data['Newcomer'] = {'Snakes on a Plane': 2.0}
+        data['Lisa Rose'] = dict(USERS_RATINGS[0][1])
+        expected = PreferencesModel([(user, ratings.items()) for user, ratings in data.items()], metric)
+        verify_same_similars(model, expected)
+        assert 'Gene Seymour' not in model.users
+        verify_ranks(model.item_based_recommendations('Toby', None), expected.item_based_recommendations('Toby', None))
+    
+    for incremental in (False, True):
+        # ratings that are not exact in binary, removed and added again
+        model = PreferencesModel((('u1', (('a', 4.7), ('b', 2.9))), ('u2', (('a', 4.9), ('b', 4.5)))),
+                                 incremental=incremental)
+        model.remove_rating('u2', 'a')
+        verify_ranks(model.item_similars['a'], [(0.0, 'b')])
+        
+        random = Random(0)
+        users, items = ['u%d' % i for i in range(8)], ['i%d' % i for i in range(6)]
+        model = PreferencesModel((), incremental=incremental)
+        for _ in range(300):
+            user, item = random.choice(users), random.choice(items)
+            if random.random() < 0.3:
+                model.remove_rating(user, item)
+            else:
+                model.add_rating(user, item, round(random.uniform(1, 5), 1))
+        expected = PreferencesModel([(user, ratings.items()) for user, ratings in model.users.items()])
+        assert sorted(model.item_similars.keys()) == sorted(expected.item_similars.keys())
+        for item, similars in expected.item_similars.items():
+            similarities = dict((b, s) for s, b in model.item_similars[item])
+            assert sorted(similarities.keys()) == sorted([b for _, b in similars])
+            for s, b in similars:
+                verify(similarities[b], s)
+
+
+def test_bounded_item_neighbors():
+    full = PreferencesModel(USERS_RATINGS)
+    for sparse in (False, True):
+        model = PreferencesModel(USERS_RATINGS, sparse=sparse, neighbors=2, min_similarity=0.2)
+        for item, similars in full.item_similars.items():
+            expected = [(s, i) for s, i in similars if s >= 0.2][:2]
+            assert len(model.item_similars[item]) == len(expected)
+            verify_ranks(model.item_similars[item], expected)
+    
+    # only Superman Returns and Lady in the Water are similar enough
+    recommendations = model.item_based_recommendations('Toby')
+    assert len(recommendations) == 1
+    verify_ranks(recommendations, [(3.6100, 'Lady in the Water')])
+    
+    model = PreferencesModel(USERS_RATINGS[:4], neighbors=3)
+    for user, ratings in USERS_RATINGS[4:]:
+        for item, rating in ratings:
+            model.add_rating(user, item, rating)
+    verify_same_similars(model, PreferencesModel(USERS_RATINGS, neighbors=3))
+
+
+def test_lsh_similar_keys():
+    exact = PreferencesModel(USERS_RATINGS)
+    for sparse in (False, True):
+        model = PreferencesModel(USERS_RATINGS, sparse=sparse)
+        model.build_lsh_index(bands=20, rows=2)
+        for user in model.users.keys():
+            assert recall_at_k(exact.similar_users(user), model.similar_users(user), 3) == 1.0
+        for item in model.items.keys():
+            assert recall_at_k(exact.similar_items(item), model.similar_items(item), 3) == 1.0
+    
+    # very selective bands find (almost) no candidate
+    model = PreferencesModel(USERS_RATINGS)
+    model.build_lsh_index(bands=1, rows=50)
+    assert recall_at_k(exact.similar_users('Toby'), model.similar_users('Toby'), 3) < 1.0
+    
+    model.add_rating('Newcomer', 'Lady in the Water', 3.0)
+    assert 'Newcomer' in model.user_lsh.signatures
+    model.remove_rating('Newcomer', 'Lady in the Water')
+    assert 'Newcomer' not in model.user_lsh.signatures
+
+
+def test_recommend_all():
+    for sparse in (False, True):
+        model = PreferencesModel(USERS_RATINGS, sparse=sparse)
+        users = model.users.keys()
+        for mode in ('user', 'item'):
+            expected = [(user, model.recommendations(user, None, mode)) for user in users]
+            assert list(model.recommend_all(users, None, mode, workers=1)) == expected
+            assert list(model.recommend_all(users, None, mode, workers=2, chunksize=2)) == expected
+
+
+def test_similarity_cache():
+    pearson = lambda X, Y: pearson_metric(X, Y)
+    model = PreferencesModel(USERS_RATINGS, pearson, cache_size=4)
+    verify(model.users_similarity('Lisa Rose', 'Gene Seymour') , 0.3961)
+    verify(model.users_similarity('Gene Seymour', 'Lisa Rose') , 0.3961)
+    assert (model.user_cache.hits, model.user_cache.misses) == (1, 1)
+    
+    verify_same_results(model, PreferencesModel(USERS_RATINGS, pearson))
+    assert len(model.user_cache) == 4 and len(model.item_cache) == 4
+    
+    # an empty cache only counts the misses
+    model = PreferencesModel(USERS_RATINGS, pearson, cache_size=0)
+    verify(model.users_similarity('Lisa Rose', 'Gene Seymour') , 0.3961)
+    verify(model.users_similarity('Gene Seymour', 'Lisa Rose') , 0.3961)
+    assert (model.user_cache.hits, model.user_cache.misses) == (0, 2) and len(model.user_cache) == 0
+    
+    model = PreferencesModel(USERS_RATINGS, pearson, cache_size=100)
+    model.similar_users('Toby')
+    assert (model.user_cache.hits, model.user_cache.misses) == (0, 6)
+    model.similar_users('Toby')
+    assert (model.user_cache.hits, model.user_cache.misses) == (6, 6)
+    
+    # new ratings invalidate the cached pairs of the user
+    model.add_rating('Toby', 'Lady in the Water', 5.0)
+    assert all(['Toby' not in pair for pair in model.user_cache.entries])
+    expected = PreferencesModel([(user, ratings.items()) for user, ratings in model.users.items()], pearson)
+    verify_ranks(model.similar_users('Toby', None), expected.similar_users('Toby', None))
+
+def test_save_and_load():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for sparse in (False, True):
+            for mmap in (False, True):
+                model = PreferencesModel(USERS_RATINGS, sparse=sparse, neighbors=3)
+                model.save(path)
+                loaded = PreferencesModel.load(path, mmap)
+                assert loaded.metric is pearson_metric
+                verify_same_similars(loaded, model)
+                verify_same_results(loaded, model)
+                
+                # the ids are looked up in the mapped names, shared by both sides
+                assert isinstance(loaded.users.key_names, NameTable)
+                assert loaded.users.key_ids is loaded.items.feature_ids
+                assert 'Nobody' not in loaded.users and len(loaded.users['Nobody']) == 0
+                
+                # and it can be saved again over the file it maps
+                loaded.save(path)
+                verify_same_results(PreferencesModel.load(path, mmap), model)
+        
+        model = PreferencesModel(USERS_RATINGS, sparse=True)
+        assert model.users.key_ids is model.items.feature_ids
+        
+        PreferencesModel(USERS_RATINGS, lambda X, Y: pearson_metric(X, Y)).save(path)
+        loaded = PreferencesModel.load(path, metric=euclidean_metric)
+        assert loaded.metric is euclidean_metric
+        
+        # other metrics are unpickled only on request
+        PreferencesModel(USERS_RATINGS, squared_pearson).save(path)
+        try:
+            PreferencesModel.load(path)
+            assert False
+        except Exception as e:
+            assert "metric" in str(e)
+        assert PreferencesModel.load(path, unpickle_metric=True).metric is squared_pearson
+        
+        # the header is never unpickled
+        header = pickle.dumps({'meta': None, 'arrays': {}})
+        with open(path, 'wb') as f:
+            f.write(PREFIX.pack(PreferencesModel.SNAPSHOT_MAGIC, 1, len(header)) + header)
+        try:
+            PreferencesModel.load(path)
+            assert False
+        except Exception as e:
+            assert "unsupported header" in str(e)
+        
+        meta = {'names': ['a', u'\xe0', '\xff\x00', ('x', 1), 2 ** 70, None], 'ids': {('x', 1): 0.1, 3: True}}
+        write_arrays(path, 'TESTFILE', 1, meta, {'values': zeros((2, 3), dtype='float32')})
+        version, loaded_meta, arrays = read_arrays(path, 'TESTFILE')
+        assert loaded_meta == meta
+        assert [type(name) for name in loaded_meta['names']] == [type(name) for name in meta['names']]
+        assert arrays['values'].shape == (2, 3) and arrays['values'].dtype == 'float32'
+    finally:
+        os.remove(path)
+
+
+def squared_pearson(X, Y):
+    return pearson_metric(X, Y) ** 2
+
+
+def test_streaming_ratings():
+    lines = ['# user, item, rating']
+    for user, ratings in USERS_RATINGS:
+        for item, rating in ratings:
+            lines.append('%s,"%s",%.1f' % (user, item, rating))
+    lines += ['Toby,Just My Luck,1.0', '', 'Toby,Just My Luck,2.0']
+    
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines))
+        
+        for sparse in (False, True):
+            reported = []
+            model = PreferencesModel.from_ratings(path, sparse=sparse, progress=reported.append, progress_every=10)
+            assert reported == [10, 20, 30, 37]
+            verify(model.users['Toby']['Just My Luck'], 2.0)
+            
+            model = PreferencesModel.from_ratings(open(path), sparse=sparse, duplicates='mean')
+            verify(model.users['Toby']['Just My Luck'], 1.5)
+            verify(model.items['Just My Luck']['Toby'], 1.5)
+            
+            # an iterable of lines is read as the file
+            reported = []
+            model = PreferencesModel.from_ratings(iter(lines), sparse=sparse, progress=reported.append, progress_every=10)
+            assert reported == [10, 20, 30, 37]
+            verify(model.users['Toby']['Just My Luck'], 2.0)
+    finally:
+        os.remove(path)
+    
+    rows = [(user, item, rating) for user, ratings in USERS_RATINGS for item, rating in ratings]
+    reported = []
+    model = PreferencesModel.from_ratings(iter(rows), progress=reported.append, progress_every=10)
+    assert reported == [10, 20, 30, len(rows)]
+    verify_same_results(model, PreferencesModel(USERS_RATINGS))
+    assert len(PreferencesModel.from_ratings(iter([])).users) == 0
+
+
 if __name__ == '__main__':
+    test_sparse_preferences_model()
+    test_batch_similarities()
+    test_incremental_item_similarities()
+    test_bounded_item_neighbors()
+    test_lsh_similar_keys()
+    test_recommend_all()
+    test_similarity_cache()
+    test_save_and_load()
+    test_streaming_ratings()
+    
     model = PreferencesModel(USERS_RATINGS)
     
     verify(model.users_similarity('Lisa Rose', 'Gene Seymour') , 0.3961)